@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import shutil
+import hashlib
+import logging
+
+from conf import conf
+
+logger = logging.getLogger(__name__)
+
+
+class DerivativeCache:
+    """
+    Persistent on-disk cache of generated derivatives (resized pictures and thumbnails). Entries are keyed by the
+    checksum of the source photo and the settings the derivatives were generated with, so changing the size or the
+    quality of derivatives never returns stale images. Each entry is a directory with one JPEG file per derivative.
+    Derivatives that are the source photo itself are not stored. The cache is bounded in size and the least recently
+    used entries are evicted first.
+    """
+
+    ENTRY_NAME = re.compile("^[0-9a-f]{40}$")
+
+    def __init__(self, path, settings, max_size=None):
+        """
+        :param path: cache directory
+        :param settings: a string describing derivative settings, which is part of the cache key
+        :param max_size: maximum size of the cache in bytes
+        """
+        logger.setLevel(conf.verbose)
+
+        self.path = os.path.expanduser(path)
+        self.settings = settings
+        self.max_size = max_size
+
+
+    def _entryPath(self, checksum):
+        key = hashlib.sha1(checksum + "|" + self.settings).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+
+    def get(self, checksum):
+        """
+        Look up derivatives of a photo
+        :param checksum: SHA1 checksum of the source photo
+        :return: a dictionary of derivative names and paths to cached files or None if the photo is not cached.
+                 Derivatives missing from the dictionary are the source photo itself
+        """
+        entry_path = self._entryPath(checksum)
+
+        try:
+            derivatives = dict((os.path.splitext(file_name)[0], os.path.join(entry_path, file_name))
+                               for file_name in os.listdir(entry_path))
+            os.utime(entry_path, None)  # mark the entry as recently used
+        except OSError:
+            return None
+
+        logger.debug("Cache hit for {}".format(checksum))
+        return derivatives
+
+
+    def put(self, checksum, derivatives):
+        """
+        Store derivatives of a photo. Derivatives kept in temporary files are moved into the cache and updated to
+        point to the cached files
+        :param checksum: SHA1 checksum of the source photo
+        :param derivatives: a dictionary of derivative names and Derivative objects
+        :return: True if derivatives were stored
+        """
+        entry_path = self._entryPath(checksum)
+        temp_path = "{}.{}.tmp".format(entry_path, os.getpid())
+
+        try:
+            os.makedirs(temp_path)
+
+            for name, derivative in derivatives.items():
+                file_path = os.path.join(temp_path, name + ".jpg")
+
+                if derivative.data is not None:
+                    with open(file_path, "wb") as f:
+                        f.write(derivative.data)
+                else:
+                    shutil.copyfile(derivative.path, file_path)
+
+            # entries become visible atomically. If another process has stored the same entry meanwhile, then this one
+            # is dropped
+            os.rename(temp_path, entry_path)
+        except (OSError, IOError):
+            if not os.path.isdir(entry_path):
+                logger.warning("Cannot store derivatives of {} in the cache".format(checksum), exc_info=True)
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return False
+
+        for name, derivative in derivatives.items():
+            if derivative.data is None:
+                derivative.cleanup()
+                derivative.path = os.path.join(entry_path, name + ".jpg")
+
+        return True
+
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits into its maximum size
+        :return: number of entries deleted
+        """
+        if self.max_size is None or not os.path.isdir(self.path):
+            return 0
+
+        entries = []
+        total_size = 0
+
+        # only entry directories are considered. Stray files and entries being stored by another process are skipped
+        for prefix in os.listdir(self.path):
+            prefix_path = os.path.join(self.path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_path):
+                continue
+
+            for key in os.listdir(prefix_path):
+                entry_path = os.path.join(prefix_path, key)
+                if not self.ENTRY_NAME.match(key) or not os.path.isdir(entry_path):
+                    continue
+
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry_path, file_name))
+                               for file_name in os.listdir(entry_path))
+                    entries.append((os.path.getmtime(entry_path), size, entry_path))
+                except OSError:  # deleted meanwhile
+                    continue
+
+                total_size += size
+
+        evicted = 0
+        for mtime, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
+            evicted += 1
+
+        logger.info("Evicted {} entries from the cache".format(evicted))
+        return evicted
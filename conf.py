@@ -7,6 +7,9 @@ import logging
 class Conf:
     IPHOTO_DEFAULT_PATH = "~/Pictures/iPhoto Library/"
     APERTURE_DEFAULT_PATH = "~/Pictures/Aperture Library.aplibrary/"
+    JOURNAL_DEFAULT_PATH = "~/.lycheeupload/journal.sqlite"
+    SCAN_CACHE_DEFAULT_PATH = "~/.lycheeupload/scan.json"
+    LIBRARY_CACHE_DEFAULT_PATH = "~/.lycheeupload/library"
     pass
 
 conf = Conf()
@@ -6,6 +6,7 @@ import traceback
 import logging
 
 from conf import conf
+from photo import photo_title
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +16,19 @@ class Database:
     Implements linking with Lychee DB
     """
 
+    INSERT_PHOTO_QUERY = ("insert into lychee_photos " +
+                          "(id, url, public, type, width, height, " +
+                          "size, star, " +
+                          "thumbUrl, album, iso, aperture, make, " +
+                          "model, shutter, focal, takestamp, " +
+                          "description, title, checksum, medium) " +
+                          "values " +
+                          "(%s, %s, %s, %s, %s, %s, " +
+                          "%s, %s, " +
+                          "%s, %s, %s, %s, %s, " +
+                          "%s, %s, %s, %s, " +
+                          "%s, %s, %s, %s)")
+
     def __init__(self):
         """
         Takes a dictionnary of conf as input
@@ -23,6 +37,9 @@ class Database:
 
         try:
             self.albumslist = {}
+            self.photoslist = {}
+            self.pending = []
+            self.pending_deletes = []
             self.db = mysql.connector.connect(host=conf.dbHost,
                                               user=conf.dbUser,
                                               passwd=conf.dbPassword,
@@ -65,21 +82,24 @@ class Database:
             return res
 
 
-    def updateAlbumDate(self, albumid, date):
+    def updateAlbumDates(self, dates):
         """
-        Update album date to an arbitrary date
+        Update dates of albums in a single transaction
+        :param dates: a dictionary of album ids and datetime objects
+        :return: True if the dates were updated
         """
         res = True
-        query = "update lychee_albums set sysstamp= '" + date.strftime('%s') + "' where id=" + str(albumid)
         try:
             cur = self.db.cursor()
-            cur.execute(query)
+            cur.executemany("update lychee_albums set sysstamp=%s where id=%s",
+                            [(date.strftime('%s'), album_id) for album_id, date in dates.items()])
             self.db.commit()
 
-            logger.debug("Album {} datetime changed to: {}".format(albumid, date))
+            logger.debug("Dates of {} albums changed".format(len(dates)))
         except Exception:
             res = False
-            logger.error('Failed to update album date', exc_info=True)
+            logger.error('Failed to update album dates', exc_info=True)
+            self.db.rollback()
 
         finally:
             return res
@@ -119,31 +139,102 @@ class Database:
             return None
 
 
-    def photoExists(self, photo):
+    def loadPhotoList(self, album_id=None):
         """
-        Check if an album exists based on its original name
-        Parameter:
-        - photo: a valid LycheePhoto object
+        retrieve titles, checksums and sizes of all the photos in an album, or in all the albums if no album id is
+        given, in a single query and put them in self.photoslist, a dictionnary key=album id value=dictionnary
+        key=title value=set of (checksum, size)
+        returns self.photoslist
+        """
+        query = "SELECT album, title, checksum, size from lychee_photos"
+        params = []
+
+        if album_id is not None:
+            query += " where album=%s"
+            params.append(str(album_id))
+            self.photoslist[str(album_id)] = {}
+        else:
+            for album in [0] + self.albumslist.values():
+                self.photoslist[str(album)] = {}
+
+        cur = self.db.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        for album, title, checksum, size in rows:
+            self._addToPhotoList(album, title, checksum, size)
+
+        return self.photoslist
+
+
+    def _addToPhotoList(self, album_id, title, checksum, size):
+        photos = self.photoslist.setdefault(str(album_id), {})
+        photos.setdefault(photo_title(title), set()).add((checksum, size))
+
+
+    def photoExists(self, album_id, title, size=None):
+        """
+        Check if a photo exists in an album based on its original name. This check does not require the photo to be
+        processed, so it can be done before any image decoding or hashing. Photos of the album are loaded from the
+        database on the first check, following checks are in-memory lookups.
+        Parameters:
+        - album_id: id of the album
+        - title: original file name of the photo
+        - size: if provided, the photo is considered to exist only if its size in the database matches as well
         Returns a boolean
         """
         res = False
         try:
-            query = ("select * from lychee_photos where album='" + str(photo.albumid) +
-                     "' and title = '" + photo.originalname + "'")
-            cur = self.db.cursor()
-            cur.execute(query)
-            row = cur.fetchall()
-            if len(row) != 0:
-                res = True
+            if str(album_id) not in self.photoslist:
+                self.loadPhotoList(album_id)
+
+            photos = self.photoslist[str(album_id)].get(photo_title(title))
+            if photos:
+                res = size is None or size in [photo_size for checksum, photo_size in photos]
 
         except Exception:
-            print "ERROR photoExists:", photo.srcfullpath, "won't be added to lychee"
+            print "ERROR photoExists:", title, "won't be added to lychee"
             traceback.print_exc()
             res = True
         finally:
             return res
 
 
+    def getAlbumPhotos(self, album_id):
+        """
+        Retrieve photos of an album for synchronisation
+        Parameter:
+        - album_id: id of the album
+        Returns a dictionnary key=title (unicode) value=list of (id, checksum, url) tuples
+        """
+        photos = {}
+
+        cur = self.db.cursor()
+        cur.execute("select id, title, checksum, url from lychee_photos where album=%s", (str(album_id),))
+        for photo_id, title, checksum, url in cur.fetchall():
+            photos.setdefault(photo_title(title), []).append((str(photo_id), checksum, url))
+
+        return photos
+
+
+    def photoIdsExist(self, photo_ids):
+        """
+        Find out which of the given photos are in the database
+        Parameter:
+        - photo_ids: a list of photo ids
+        Returns a set of the ids of photos that exist
+        """
+        photo_ids = list(photo_ids)
+        existing = set()
+
+        cur = self.db.cursor()
+        for i in range(0, len(photo_ids), 500):
+            chunk = photo_ids[i:i + 500]
+            cur.execute("select id from lychee_photos where id in ({})".format(", ".join(["%s"] * len(chunk))), chunk)
+            existing.update(str(row[0]) for row in cur.fetchall())
+
+        return existing
+
+
     def createAlbum(self, album_name):
         """
         Creates an album
@@ -164,8 +255,9 @@ class Database:
             query = "select id from lychee_albums where title='" + album_name + "'"
             cur.execute(query)
             row = cur.fetchone()
-            self.albumslist['name'] = row[0]
+            self.albumslist[album_name] = row[0]
             id = row[0]
+            self.photoslist[str(id)] = {}
 
             logger.info("Album {} created".format(album_name))
 
@@ -176,70 +268,94 @@ class Database:
             return id
 
 
-    def eraseAlbum(self, id):
+    def addFileToAlbum(self, photo):
         """
-        Deletes all photos of an album but don't delete the album itself
-        Parameters:
-        - album: the album properties list to erase.  At least its id must be provided
-        Return list of the erased photo url
+        Queue a photo to be added to an album. Queued photos are inserted into the database by flush()
+        Parameter:
+        - photo: a valid LycheePhoto object
+        Returns the number of photos waiting to be inserted
         """
-        query = "delete from lychee_photos where album = " + id + ''
-        selquery = "select url from lychee_photos where album = " + id + ''
+        self.pending.append(photo)
+        return len(self.pending)
 
-        file_list = []
-        try:
-            cur = self.db.cursor()
-            cur.execute(selquery)
-            rows = cur.fetchall()
-            for row in rows:
-                file_list.append(row[0])
-            cur.execute(query)
-            self.db.commit()
-            logger.info("Album #{} deleted.".format(id))
-
-            return file_list
-        except Exception:
-            logger.error('Failed to delete album #{}'.format(id), exc_info=True)
-
-            return None
 
+    def deletePhotos(self, photos):
+        """
+        Queue photos to be deleted. Queued photos are deleted by flush() in the same transaction as queued photos are
+        inserted
+        Parameter:
+        - photos: a list of (id, checksum, url) tuples as returned by getAlbumPhotos
+        """
+        self.pending_deletes.extend(photos)
 
 
-    def addFileToAlbum(self, photo):
+    def flush(self):
         """
-        Add a photo to an album
-        Parameter:
-        - photo: a valid LycheePhoto object
-        Returns a boolean
+        Delete and insert all the queued photos in one transaction. Photos are inserted with a single multi-row insert.
+        If the transaction fails, queued deletes are retried in a transaction of their own and photos are inserted one
+        by one, so that only the offending photos are rejected.
+        Returns a tuple of a list of LycheePhoto objects that could not be inserted and a list of deleted photos
         """
-        try:
-            query = ("insert into lychee_photos " +
-                     "(id, url, public, type, width, height, " +
-                     "size, star, " +
-                     "thumbUrl, album, iso, aperture, make, " +
-                     "model, shutter, focal, takestamp, " +
-                     "description, title, checksum, medium) " +
-                     "values " +
-                     "({}, '{}', {}, '{}', {}, {}, " +
-                     "'{}', {}, " +
-                     "'{}', '{}', '{}', '{}', '{}', " +
-                     "'{}', '{}', '{}', '{}', " +
-                     "'{}', '{}', '{}', {})"
-                     ).format(photo.id, photo.url, conf.public, photo.type, photo.width, photo.height,
-                              photo.size, photo.star,
-                              photo.url, photo.albumid, photo.exif.iso, photo.exif.aperture, photo.exif.make,
-                              photo.exif.model, photo.exif.shutter, photo.exif.focal, photo.datetime.strftime("%s"),
-                              photo.description, photo.originalname, photo.checksum, 1)
+        photos, self.pending = self.pending, []
+        deletes, self.pending_deletes = self.pending_deletes, []
+        if not photos and not deletes:
+            return [], []
 
+        try:
             cur = self.db.cursor()
-            cur.execute(query)
+            if deletes:
+                cur.executemany("delete from lychee_photos where id=%s", [(photo[0],) for photo in deletes])
+            if photos:
+                cur.executemany(self.INSERT_PHOTO_QUERY, [self._photoRow(photo) for photo in photos])
             self.db.commit()
 
-            return True
-        except Exception as e:
-            logger.error("Inserting photo {} into database failed".format(photo.id), exc_info=True)
+            for photo in photos:
+                self._addToPhotoList(photo.albumid, photo.originalname, photo.checksum, photo.size)
 
-            return False
+            logger.debug("Deleted {} and inserted {} photos".format(len(deletes), len(photos)))
+            return [], deletes
+        except Exception:
+            logger.debug("Updating a batch of {} photos failed. Retrying one by one".format(len(photos)),
+                         exc_info=True)
+            self.db.rollback()
+
+        if deletes:
+            try:
+                cur = self.db.cursor()
+                cur.executemany("delete from lychee_photos where id=%s", [(photo[0],) for photo in deletes])
+                self.db.commit()
+            except Exception:
+                logger.error("Deleting {} photos from database failed".format(len(deletes)), exc_info=True)
+                self.db.rollback()
+                deletes = []
+
+        failed = []
+        for photo in photos:
+            try:
+                cur = self.db.cursor()
+                cur.execute(self.INSERT_PHOTO_QUERY, self._photoRow(photo))
+                self.db.commit()
+                self._addToPhotoList(photo.albumid, photo.originalname, photo.checksum, photo.size)
+            except Exception:
+                logger.error("Inserting photo {} into database failed".format(photo.id), exc_info=True)
+                self.db.rollback()
+                failed.append(photo)
+
+        return failed, deletes
+
+
+    def _photoRow(self, photo):
+        """
+        Convert a photo into a row of values for INSERT_PHOTO_QUERY
+        """
+        def text(value):
+            return value if isinstance(value, basestring) else str(value)
+
+        return (photo.id, photo.url, conf.public, photo.type, photo.width, photo.height,
+                photo.size, photo.star,
+                photo.url, str(photo.albumid), text(photo.exif.iso), text(photo.exif.aperture), text(photo.exif.make),
+                text(photo.exif.model), text(photo.exif.shutter), text(photo.exif.focal), photo.datetime.strftime("%s"),
+                text(photo.description), photo.originalname, photo.checksum, 1)
 
 
     def close(self):
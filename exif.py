@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import io
+import struct
+import logging
+import datetime
+
+import tiff
+from conf import conf
+
+logger = logging.getLogger(__name__)
+
+# EXIF tags stored by Lychee and the ExifData attributes they are stored in
+IFD0_TAGS = {0x010F: "make", 0x0110: "model", 0x0112: "orientation", 0x0132: "datetime"}
+EXIF_IFD_TAGS = {0x829A: "shutter", 0x8827: "iso", 0x9205: "aperture", 0x920A: "focal"}
+
+EXIF_IFD_POINTER = 0x8769
+
+MAX_JPEG_SEGMENTS = 64
+
+
+class ExifData(object):
+    """
+    Use to store ExifData
+    """
+
+    __slots__ = ("iso", "aperture", "make", "model", "shutter", "focal", "_takedate", "taketime", "orientation",
+                 "datetime")
+
+    def __init__(self):
+        self.iso = ""
+        self.aperture = ""
+        self.make = ""
+        self.model = ""
+        self.shutter = ""
+        self.focal = ""
+        self._takedate = ""
+        self.taketime = ""
+        self.orientation = 0
+        self.datetime = ""
+
+    @property
+    def takedate(self):
+        """I'm the 'x' property."""
+        return self._takedate.replace(':', '-')
+
+    @takedate.setter
+    def takedate(self, value):
+        self._takedate = value.replace(':', '-')
+
+    def __str__(self):
+        res = ""
+        res += "iso: " + str(self.iso) + "\n"
+        res += "aperture: " + str(self.aperture) + "\n"
+        res += "make: " + str(self.make) + "\n"
+        res += "model: " + str(self.model) + "\n"
+        res += "shutter: " + str(self.shutter) + "\n"
+        res += "focal: " + str(self.focal) + "\n"
+        res += "_takedate: " + str(self._takedate) + "\n"
+        res += "takedate: " + str(self.takedate) + "\n"
+        res += "taketime: " + str(self.taketime) + "\n"
+        res += "orientation: " + str(self.orientation) + "\n"
+        res += "datetime: " + str(self.datetime) + "\n"
+        return res
+
+
+def read_exif(path, f=None):
+    """
+    Read EXIF data of a photo without decoding it. Only the EXIF segment of JPEG files is read, TIFF based files (RAW
+    formats) are read directly. Only the tags stored by Lychee are parsed, MakerNote and other tags are skipped.
+    :param path: path to the photo
+    :param f: a file object of the photo opened in binary mode, if the photo is open already
+    :return: an ExifData object or None if the photo has no EXIF data
+    """
+    logger.setLevel(conf.verbose)
+
+    try:
+        if f is not None:
+            f.seek(0)
+            return read_exif_stream(f)
+
+        with open(path, "rb") as f:
+            return read_exif_stream(f)
+    except (IOError, tiff.TiffError, struct.error):
+        logger.debug("Cannot read EXIF data of {}".format(path), exc_info=True)
+        return None
+
+
+def read_exif_stream(f):
+    """
+    Read EXIF data from a file object of a JPEG or a TIFF based file
+    :param f: a file object opened in binary mode
+    :return: an ExifData object or None if there is no EXIF data
+    """
+    header = f.read(4)
+
+    if header[:2] == "\xff\xd8":
+        payload = _read_app1(f)
+        if payload is None:
+            return None
+        reader = tiff.TiffReader(io.BytesIO(payload))
+    elif header in ("II*\x00", "MM\x00*"):
+        reader = tiff.TiffReader(f)
+    else:
+        return None
+
+    exif = ExifData()
+
+    tags, next_ifd = reader.readIfd(reader.first_ifd, set(IFD0_TAGS) | set([EXIF_IFD_POINTER]))
+    found = _store_tags(exif, IFD0_TAGS, tags)
+
+    if EXIF_IFD_POINTER in tags:
+        try:
+            exif_tags, next_ifd = reader.readIfd(tags[EXIF_IFD_POINTER][0], EXIF_IFD_TAGS)
+            found += _store_tags(exif, EXIF_IFD_TAGS, exif_tags)
+        except (tiff.TiffError, struct.error):
+            logger.debug("Cannot read EXIF IFD", exc_info=True)
+
+    return exif if found else None
+
+
+def parse_datetime(value):
+    """
+    Parse an EXIF date and time
+    :param value: date and time in the EXIF format, e.g. "2015:07:14 18:30:05"
+    :return: a datetime object or None if the value is not a valid date
+    """
+    try:
+        return datetime.datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return None
+
+
+def _read_app1(f):
+    """
+    Find the EXIF APP1 segment of a JPEG file. Segments before it are skipped without reading them
+    :param f: a file object of the JPEG file
+    :return: the TIFF structure stored in the segment or None if there is no EXIF segment
+    """
+    f.seek(2)
+
+    for i in range(MAX_JPEG_SEGMENTS):
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != "\xff":
+            return None
+
+        code = ord(marker[1])
+        length = struct.unpack(">H", marker[2:])[0]
+
+        if code == 0xda or code == 0xd9:  # image data starts, no EXIF segment
+            return None
+
+        if code == 0xe1:
+            data = f.read(length - 2)
+            if data[:6] == "Exif\x00\x00":
+                return data[6:]
+        else:
+            f.seek(length - 2, 1)
+
+    return None
+
+
+def _store_tags(exif, tag_map, tags):
+    """
+    Store values of tags in an ExifData object. Values are converted the way PIL returns them: single values as
+    scalars and rationals as (numerator, denominator) tuples
+    :return: number of stored tags
+    """
+    count = 0
+
+    for tag, value in tags.items():
+        if tag not in tag_map:
+            continue
+        if isinstance(value, list):
+            value = value[0] if len(value) == 1 else tuple(value)
+
+        setattr(exif, tag_map[tag], value)
+        count += 1
+
+    return count
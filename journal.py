@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import datetime
+import threading
+import logging
+
+from conf import conf
+from exif import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Local SQLite journal of uploaded files. Every source file uploaded to Lychee is recorded with its size,
+    modification time, checksum, photo id, album id and EXIF date, so that following runs can skip unchanged files without
+    opening them or querying the remote database. Records are kept per Lychee installation (user@host:path), so the
+    same journal can be used with several servers.
+
+    Photos being uploaded are recorded in the journal before any file is transferred, together with the list of their
+    remote files. If the process dies, the next run finds these in-flight photos and either completes their records or
+    removes their files from the server, see Upload.recover().
+    """
+
+    def __init__(self, path, target):
+        """
+        :param path: path to the journal file. It is created if it does not exist
+        :param target: the Lychee installation photos are uploaded to
+        """
+        logger.setLevel(conf.verbose)
+
+        path = os.path.expanduser(path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.target = target
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "target TEXT NOT NULL, "
+                        "path TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, "
+                        "mtime REAL NOT NULL, "
+                        "checksum TEXT NOT NULL, "
+                        "photo_id TEXT NOT NULL, "
+                        "album_id TEXT NOT NULL, "
+                        "date REAL, "
+                        "PRIMARY KEY (target, path))")
+
+        # journals created by older versions have no dates
+        if "date" not in [column[1] for column in self.db.execute("PRAGMA table_info(files)")]:
+            self.db.execute("ALTER TABLE files ADD COLUMN date REAL")
+
+        self.db.execute("CREATE TABLE IF NOT EXISTS inflight ("
+                        "target TEXT NOT NULL, "
+                        "photo_id TEXT NOT NULL, "
+                        "path TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, "
+                        "mtime REAL NOT NULL, "
+                        "checksum TEXT NOT NULL, "
+                        "album_id TEXT NOT NULL, "
+                        "files TEXT NOT NULL, "
+                        "PRIMARY KEY (target, photo_id))")
+        self.db.commit()
+
+        logger.info("Opened journal {}".format(path))
+
+
+    def uploadedDate(self, full_path, album_id, size=None, mtime=None):
+        """
+        Check if a file was uploaded to an album and has not changed since. Only the file size and modification time
+        are compared, the file itself is not read
+        :param full_path: full path to the file
+        :param album_id: id of the album
+        :param size: size of the file, if it is known already
+        :param mtime: modification time of the file, if it is known already
+        :return: None if the file was not uploaded or has changed. Otherwise the EXIF date of the photo recorded when it
+                 was uploaded, or its modification time if it has no EXIF date
+        """
+        if size is None or mtime is None:
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                return None
+
+            size, mtime = stat.st_size, stat.st_mtime
+
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime, album_id, date FROM files WHERE target=? AND path=?",
+                                  (self.target, self._key(full_path))).fetchone()
+
+        if row is None or row[:3] != (size, mtime, str(album_id)):
+            return None
+
+        return datetime.datetime.fromtimestamp(row[3] if row[3] is not None else mtime)
+
+
+    def record(self, photos):
+        """
+        Record uploaded photos in one transaction. Photos are not in flight anymore
+        :param photos: a list of LycheePhoto objects
+        """
+        rows = [(self.target, self._key(photo.srcfullpath), photo.filesize, photo.mtime, photo.checksum, photo.id,
+                 str(photo.albumid), self._timestamp(parse_datetime(photo.exif.datetime))) for photo in photos]
+
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO files "
+                                "(target, path, size, mtime, checksum, photo_id, album_id, date) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.executemany("DELETE FROM inflight WHERE target=? AND photo_id=?",
+                                [(self.target, photo.id) for photo in photos])
+            self.db.commit()
+
+
+    def begin(self, photo, files):
+        """
+        Record a photo, which is about to be uploaded. Must be called before any of its files is transferred
+        :param photo: a LycheePhoto object
+        :param files: a list of paths to the files of the photo on the remote server
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO inflight "
+                            "(target, photo_id, path, size, mtime, checksum, album_id, files) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (self.target, photo.id, self._key(photo.srcfullpath), photo.filesize, photo.mtime,
+                             photo.checksum, str(photo.albumid), "\n".join(files)))
+            self.db.commit()
+
+
+    def inflight(self):
+        """
+        Get photos that were being uploaded when the process stopped
+        :return: a dictionary of photo ids and lists of paths to their files on the remote server
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT photo_id, files FROM inflight WHERE target=?", (self.target,)).fetchall()
+
+        return dict((photo_id, files.split("\n")) for photo_id, files in rows)
+
+
+    def commitInflight(self, photo_ids):
+        """
+        Record in-flight photos, which turned out to be in the Lychee database, as uploaded
+        :param photo_ids: a list of photo ids
+        """
+        with self.lock:
+            for photo_id in photo_ids:
+                self.db.execute("INSERT OR REPLACE INTO files "
+                                "(target, path, size, mtime, checksum, photo_id, album_id) "
+                                "SELECT target, path, size, mtime, checksum, photo_id, album_id FROM inflight "
+                                "WHERE target=? AND photo_id=?", (self.target, photo_id))
+                self.db.execute("DELETE FROM inflight WHERE target=? AND photo_id=?", (self.target, photo_id))
+            self.db.commit()
+
+
+    def forgetInflight(self, photo_ids):
+        """
+        Drop in-flight photos, once their files were removed from the server
+        :param photo_ids: a list of photo ids
+        """
+        with self.lock:
+            self.db.executemany("DELETE FROM inflight WHERE target=? AND photo_id=?",
+                                [(self.target, photo_id) for photo_id in photo_ids])
+            self.db.commit()
+
+
+    def forgetPhotos(self, photo_ids):
+        """
+        Drop records of photos deleted from Lychee
+        :param photo_ids: a list of photo ids
+        """
+        with self.lock:
+            self.db.executemany("DELETE FROM files WHERE target=? AND photo_id=?",
+                                [(self.target, photo_id) for photo_id in photo_ids])
+            self.db.commit()
+
+
+    def close(self):
+        """
+        Close the journal
+        """
+        with self.lock:
+            self.db.close()
+
+
+    def _timestamp(self, date):
+        return time.mktime(date.timetuple()) if date else None
+
+
+    def _key(self, full_path):
+        path = os.path.abspath(full_path)
+        return path.decode("utf-8", "replace") if isinstance(path, str) else path
@@ -56,7 +56,17 @@ def parse_arguments():
     source_group.add_argument('-d', '--dir', help="path to the photo directory where to export photos from.", type=str)
 
     parser.add_argument('-r', '--replace', help="replace albums in Lychee with local ones", action='store_true')
+    parser.add_argument('--check-size', help="upload photos that exist in the album, but differ in size",
+                        action='store_true')
+    parser.add_argument('--journal', metavar="path", nargs="?", const=conf.JOURNAL_DEFAULT_PATH, type=str,
+                        help="keep a journal of uploaded files and skip unchanged files on following runs. If path is "
+                             "not provided, then default location is used.")
+    parser.add_argument('--scan-cache', metavar="path", nargs="?", const=conf.SCAN_CACHE_DEFAULT_PATH, type=str,
+                        help="cache directory listings and skip listing unchanged directories on following runs. If "
+                             "path is not provided, then default location is used.")
+    parser.add_argument('--scan-threads', help="number of threads listing directories in parallel", type=int)
     parser.add_argument('-P', '--port', help="alternative SSH port", type=int)
+    parser.add_argument('-c', '--connections', help="number of parallel SFTP transfers", type=int)
     parser.add_argument('-p', '--public', help="make uploaded photos public", action='store_true')
     parser.add_argument('-v', '--verbose', help='print verbose messages', action='store_true')
     parser.add_argument('-q', '--quality', help='JPEG quality 0-99 for resized pictures', type=int)
@@ -66,6 +76,22 @@ def parse_arguments():
     parser.add_argument('--originals',
                         help='Upload original untouched files. To be used with the --big option, otherwise ignored.',
                         action='store_true')
+    parser.add_argument('-j', '--jobs', help='number of processes generating thumbnails and resized pictures',
+                        type=int)
+    parser.add_argument('--batch', help='number of photos inserted into the database in one transaction',
+                        type=int)
+    parser.add_argument('--in-memory', help='Keep resized pictures and thumbnails in memory instead of temporary files',
+                        action='store_true')
+    parser.add_argument('--memory-limit', help='Maximum size in MB of a picture kept in memory. 16MB by default',
+                        type=int)
+    parser.add_argument('--cache-dir', help='Directory where resized pictures and thumbnails are cached between runs',
+                        type=str)
+    parser.add_argument('--cache-size', help='Maximum size of the cache in MB. 1024MB by default', type=int)
+    parser.add_argument('--draft', help='Decode JPEG files at a reduced scale when generating smaller pictures. '
+                                        'Faster, but slightly lower quality', action='store_true')
+    parser.add_argument('--full-big', help='Always decode JPEG files at full scale for big sized pictures. '
+                                           'To be used with the --draft and --big options, otherwise ignored',
+                        action='store_true')
 
     if conf.osx:
         add_mac_arguments(parser, source_group)
@@ -74,6 +100,9 @@ def parse_arguments():
 
     conf.replace = args.replace
     conf.public = args.public
+    conf.check_size = args.check_size
+    conf.journal = args.journal
+    conf.scan_cache = args.scan_cache
 
     if args.verbose:
         conf.verbose = logging.DEBUG
@@ -98,6 +127,16 @@ def parse_arguments():
     else:
         conf.port = 22
 
+    if args.connections:
+        conf.connections = args.connections
+    else:
+        conf.connections = 4
+
+    if args.scan_threads:
+        conf.scan_threads = args.scan_threads
+    else:
+        conf.scan_threads = 8
+
     if args.quality:
         conf.quality = args.quality
     else:
@@ -114,6 +153,33 @@ def parse_arguments():
     if args.originals and args.big:
         conf.upload_originals = True
 
+    if args.jobs:
+        conf.jobs = args.jobs
+    else:
+        conf.jobs = 1
+
+    if args.batch:
+        conf.batch_size = args.batch
+    else:
+        conf.batch_size = 100
+
+    conf.in_memory = args.in_memory
+
+    if args.memory_limit:
+        conf.memory_limit = args.memory_limit * 1024 * 1024
+    else:
+        conf.memory_limit = 16 * 1024 * 1024
+
+    conf.cache_dir = args.cache_dir
+
+    if args.cache_size:
+        conf.cache_size = args.cache_size * 1024 * 1024
+    else:
+        conf.cache_size = 1024 * 1024 * 1024
+
+    conf.draft = args.draft
+    conf.full_big = args.full_big
+
     if conf.osx:
         if not parse_mac_arguments(args):
             return False
@@ -146,6 +212,8 @@ def parse_mac_arguments(args):
     :return:
     """
     conf.originals = args.originals
+    conf.library_cache = args.library_cache
+    conf.previews = args.previews
 
     library_dir = None
 
@@ -219,6 +287,12 @@ def add_mac_arguments(parser, group):
 
     parser.add_argument('-x', '--exclude', metavar="pattern", type=str,
                         help="Don't export matching albums or events. The pattern is a regular expression.")
+    parser.add_argument('--previews', action='store_true',
+                        help="Make medium sized pictures and thumbnails from previews stored in the library instead of "
+                             "original photos, when the previews are big enough. Ignored with the --big option")
+    parser.add_argument('--library-cache', metavar="path", nargs="?", const=conf.LIBRARY_CACHE_DEFAULT_PATH, type=str,
+                        help="Keep a snapshot of the parsed iPhoto / Aperture library in a directory and reuse it while "
+                             "the library does not change. If path is not provided, then default location is used.")
 
 
 if __name__ == '__main__':
@@ -2,71 +2,139 @@
 
 import time
 import tempfile
+import io
 import hashlib
 import os
+import sys
 import mimetypes
 import logging
 import datetime
+import math
+import mmap
+import threading
 
 from PIL import Image
-from PIL.ExifTags import TAGS
 
 from conf import conf
+from cache import DerivativeCache
+from exif import ExifData, read_exif, parse_datetime
+import tiff
 
 logger = logging.getLogger(__name__)
 
+HASH_CHUNK_SIZE = 1024 * 1024
 
-class ExifData:
+
+def file_size(full_path, size=None):
     """
-    Use to store ExifData
+    Get the size of a file in the format it is stored in the Lychee database
+    :param full_path: full path to the file
+    :param size: size of the file in bytes, if it is known already
+    :return: the size in kilobytes as a string, e.g. "1024 KB"
     """
+    if size is None:
+        size = os.path.getsize(full_path)
 
-    @property
-    def takedate(self):
-        """I'm the 'x' property."""
-        return self._takedate.replace(':', '-')
-
-    @takedate.setter
-    def takedate(self, value):
-        self._takedate = value.replace(':', '-')
-
-    iso = ""
-    aperture = ""
-    make = ""
-    model = ""
-    shutter = ""
-    focal = ""
-    _takedate = ""
-    taketime = ""
-    orientation = 0
+    return str(size / 1024) + " KB"
 
-    def __str__(self):
-        res = ""
-        res += "iso: " + str(self.iso) + "\n"
-        res += "aperture: " + str(self.aperture) + "\n"
-        res += "make: " + str(self.make) + "\n"
-        res += "model: " + str(self.model) + "\n"
-        res += "shutter: " + str(self.shutter) + "\n"
-        res += "focal: " + str(self.focal) + "\n"
-        res += "_takedate: " + str(self._takedate) + "\n"
-        res += "takedate: " + str(self.takedate) + "\n"
-        res += "taketime: " + str(self.taketime) + "\n"
-        res += "orientation: " + str(self.orientation) + "\n"
-        return res
-
-
-class LycheePhoto:
+
+def photo_title(file_name):
+    """
+    Get the title of a photo the way the Lychee database returns it. Titles are unicode strings, while file names are
+    byte strings, which never compare equal to them once they contain non-ASCII characters
+    :param file_name: the file name of the photo
+    :return: the file name as a unicode string
+    """
+    if not isinstance(file_name, str):
+        return file_name
+
+    try:
+        return file_name.decode("utf-8")
+    except UnicodeDecodeError:
+        return file_name.decode(sys.getfilesystemencoding() or "utf-8", "replace")
+
+
+class UnchangedPhoto(Exception):
+    """
+    Raised when a source photo turns out to be identical to the photo it would replace
+    """
+    pass
+
+
+class Derivative(object):
+    """
+    An encoded image to be uploaded. Derivatives are kept either in memory or in a temporary file, the source photo
+    itself is represented by a derivative pointing to its path.
+    """
+
+    __slots__ = ("path", "data", "temporary")
+
+    def __init__(self, path=None, data=None, temporary=False):
+        """
+        :param path: path to the image file
+        :param data: encoded image, if the derivative is kept in memory
+        :param temporary: True if the file is deleted by cleanup()
+        """
+        self.path = path
+        self.data = data
+        self.temporary = temporary
+
+
+    def source(self):
+        """
+        :return: path to the image file, or a file object to read the image from if it is kept in memory
+        """
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        else:
+            return self.path
+
+
+    def cleanup(self):
+        """
+        Release the memory buffer or delete the temporary file
+        """
+        self.data = None
+
+        if self.temporary:
+            os.remove(self.path)
+            self.temporary = False
+
+
+class LycheePhoto(object):
     """
     Store photo data such as location and file info, EXIF data, checksums and path to thumbnails. Checksum and
     thumbnails are generated here.
     """
 
+    __slots__ = ("originalname", "albumid", "description", "star", "srcfullpath", "id", "url", "thumb2xUrl",
+                 "originalUrl", "destfullpath", "type", "size", "filesize", "mtime", "datetime", "checksum", "exif", "width", "height",
+                 "big", "medium", "thumbnailx2", "thumbnail")
+
     SMALL_THUMB_SIZE = (200, 200)
     BIG_THUMB_SIZE = (400, 400)
     MEDIUM_SIZE = (1920.0, 1080.0)
 
+    DERIVATIVES = ("big", "medium", "thumbnailx2", "thumbnail")
+
+    # all derivatives of RAW photos, the big picture included, are JPEG images made from the embedded JPEG preview.
+    # The RAW file itself is uploaded only into the import directory with the --originals switch
+    RAW_EXTENSIONS = (".cr2", ".nef", ".arw", ".dng")
+
+    _last_id = 0
+    _id_lock = threading.Lock()
+
 
-    def __init__(self, full_path, album_id):
+    def __init__(self, full_path, album_id, checksum=None, previews=(), replaced_checksums=()):
+        """
+        :param full_path: full path to the source photo
+        :param album_id: id of the album the photo belongs to
+        :param checksum: SHA1 checksum of the source photo, if it has been computed already
+        :param previews: paths to pre-rendered previews of the photo, which the medium sized picture and thumbnails
+                         can be made from instead of the source photo
+        :param replaced_checksums: checksums of the Lychee photos the photo would replace. If the photo has one of
+                                   them, then UnchangedPhoto is raised right after the checksum is computed
+        """
         logger.setLevel(conf.verbose)
 
         # Parameters storage
@@ -80,10 +148,99 @@ class LycheePhoto:
         else:
             self.star = 0
 
-        # Compute Photo ID
-        self.id = str(time.time())
-        self.id = self.id.replace('.', '')
-        self.id = self.id.ljust(14, '0')
+        # src fullpath
+        self.srcfullpath = full_path
+
+        self.generateId()
+
+        # The source photo is opened once and mapped into memory. The checksum, EXIF data and the decoder all read the
+        # same mapping, so the file is read from disk only once and is never copied into memory as a whole
+        with open(self.srcfullpath, 'rb') as f:
+            source = self._mapSource(f)
+
+            try:
+                self._loadSource(f, source, checksum, previews, replaced_checksums)
+            finally:
+                if source is not f:
+                    source.close()
+
+
+    def _loadSource(self, f, source, checksum=None, previews=(), replaced_checksums=()):
+        """
+        Read file properties, the checksum and EXIF data of the source photo and generate derivatives
+        :param f: the source photo file
+        :param source: the memory mapped source photo, or the file itself if it cannot be mapped
+        :param checksum: SHA1 checksum of the source photo, if it has been computed already
+        :param previews: paths to pre-rendered previews of the photo
+        :param replaced_checksums: checksums of the Lychee photos the photo would replace
+        """
+        # Auto file some properties
+        raw = self.isRaw()
+        stat = os.fstat(f.fileno())
+        self.type = "image/jpeg" if raw else mimetypes.guess_type(self.originalname, False)[0]
+        self.size = file_size(self.srcfullpath, stat.st_size)
+        self.filesize = stat.st_size
+        self.mtime = stat.st_mtime
+        self.datetime = datetime.datetime.now()
+
+        # Generate SHA1 hash
+        self.checksum = checksum or self.generateHash(self.srcfullpath, source)
+        if self.checksum in replaced_checksums:
+            raise UnchangedPhoto(self.srcfullpath)
+
+        # Exif Data Parsing
+        self.exif = read_exif(self.srcfullpath, source)
+        if self.exif is None:
+            self.exif = ExifData()
+        else:
+            self.datetime = parse_datetime(self.exif.datetime) or self.datetime
+            self.description = self.datetime
+
+        raw_preview = None
+        try:
+            source.seek(0)
+            if raw:
+                raw_preview = self._readRawPreview(source)
+                img = Image.open(io.BytesIO(raw_preview))
+            else:
+                img = Image.open(source)
+            self.width, self.height = img.size
+        except IOError:
+            logger.error("Cannot read photo {}".format(self.srcfullpath))
+            raise
+
+        if conf.cache_dir:
+            cache = DerivativeCache(conf.cache_dir, self.derivativeSettings())
+            if not self.loadDerivatives(cache):
+                self.generateDerivatives(img, previews, raw_preview)
+                self.storeDerivatives(cache)
+        else:
+            self.generateDerivatives(img, previews, raw_preview)
+
+
+    def _mapSource(self, f):
+        """
+        Map the source photo into memory
+        :param f: the source photo file
+        :return: a read-only mmap object, or the file itself if it cannot be mapped, e.g. because it is empty
+        """
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            logger.debug("Cannot map {} into memory".format(self.srcfullpath), exc_info=True)
+            return f
+
+
+    def generateId(self):
+        """
+        Compute the photo id and the file storage urls derived from it. Photos built in worker processes get their id
+        regenerated in the uploading process, so that ids are assigned the same way as in a serial run.
+        """
+        # Compute Photo ID. Ids are timestamps with 1/10000 s precision, bumped if needed to stay unique
+        with LycheePhoto._id_lock:
+            photo_id = max(int(time.time() * 10000), LycheePhoto._last_id + 1)
+            LycheePhoto._last_id = photo_id
+        self.id = str(photo_id)
 
         # Compute file storage url
         m = hashlib.md5()
@@ -91,166 +248,349 @@ class LycheePhoto:
         crypted = m.hexdigest()
 
         ext = os.path.splitext(self.originalname)[1]
+        self.originalUrl = ''.join([crypted, ext]).lower()
+
+        # derivatives of RAW photos are JPEG images
+        if self.isRaw():
+            ext = ".jpg"
         self.url = ''.join([crypted, ext]).lower()
         self.thumb2xUrl = ''.join([crypted, "@2x", ext]).lower()
 
-        # src and dest fullpath
-        self.srcfullpath = full_path
+        # dest fullpath
         self.destfullpath = os.path.join(conf.path, "uploads", "big", self.url)
 
-        # Auto file some properties
-        self.type = mimetypes.guess_type(self.originalname, False)[0]
-        self.size = os.path.getsize(self.srcfullpath)
-        self.size = str(self.size / 1024) + " KB"
-        self.datetime = datetime.datetime.now()
 
-        # Exif Data Parsing
-        self.exif = ExifData()
+    def isRaw(self):
+        """
+        :return: True if the source photo is in a RAW format
+        """
+        return os.path.splitext(self.originalname)[1].lower() in self.RAW_EXTENSIONS
+
+
+    @classmethod
+    def derivativeSettings(cls):
+        """
+        Describe the settings derivatives are generated with. Used as a part of the derivative cache key
+        :return: a settings string
+        """
+        return "thumbs={},{};medium={};big={};quality={};draft={},{};previews={}".format(
+            cls.SMALL_THUMB_SIZE[0], cls.BIG_THUMB_SIZE[0], conf.medium_size, getattr(conf, "big_size", None),
+            conf.quality, conf.draft, conf.full_big, getattr(conf, "previews", False))
+
+
+    def loadDerivatives(self, cache):
+        """
+        Use derivatives from the derivative cache
+        :param cache: a DerivativeCache object
+        :return: True if derivatives were found in the cache
+        """
+        paths = cache.get(self.checksum)
+        if paths is None:
+            return False
+
+        # none of the derivatives of a RAW photo is the source photo itself
+        if self.isRaw() and len(paths) < len(self.DERIVATIVES):
+            return False
+
+        for name in self.DERIVATIVES:
+            setattr(self, name, Derivative(paths.get(name, self.srcfullpath)))
+
+        return True
+
+
+    def storeDerivatives(self, cache):
+        """
+        Store generated derivatives in the derivative cache. Derivatives that are the source photo are not stored
+        :param cache: a DerivativeCache object
+        """
+        derivatives = {}
+        for name in self.DERIVATIVES:
+            derivative = getattr(self, name)
+            if derivative.path != self.srcfullpath:
+                derivatives[name] = derivative
+
+        cache.put(self.checksum, derivatives)
+
+
+    def generateDerivatives(self, img, previews=(), raw_preview=None):
+        """
+        Produce the big, medium and thumbnail images from a single decode of the source photo. Derivatives are
+        generated from the biggest to the smallest one and each derivative is made from the previous one, as long as
+        the latter is still big enough, so the full resolution bitmap is processed only once. If the big picture is
+        the source photo itself and a suitable preview is available, then the source photo is not decoded at all.
+        :param img: opened PIL image of the source photo
+        :param previews: paths to pre-rendered previews of the source photo
+        :param raw_preview: the embedded JPEG preview if the source photo is a RAW file and img is the preview. The
+                            preview takes the place of the source photo, so it is uploaded as it is where no resize is
+                            needed
+        """
+        resize_big = "big_size" in dir(conf)
+
+        if raw_preview is not None:
+            original = self._store(raw_preview)
+        else:
+            original = Derivative(self.srcfullpath)
+
+        candidates = []
+        if previews and not resize_big:
+            candidates = self._openPreviews(previews, img.size)
+
         try:
-            img = Image.open(self.srcfullpath)
-            self.width, self.height = img.size
-            if hasattr(img, '_getexif'):
-                exifinfo = img._getexif()
-                if exifinfo is not None:
-                    for tag, value in exifinfo.items():
-                        decode = TAGS.get(tag, tag)
-                        #print tag, decode, value
-                        #if decode != "MakerNote":
-                        #    print decode, value
-                        if decode == "Orientation":
-                            self.exif.orientation = value
-                        if decode == "Make":
-                            self.exif.make = value
-                        if decode == "MaxApertureValue":
-                            self.exif.aperture = value
-                        if decode == "FocalLength":
-                            self.exif.focal = value
-                        if decode == "ISOSpeedRatings":
-                            self.exif.iso = value
-                        if decode == "Model":
-                            self.exif.model = value
-                        if decode == "ExposureTime":
-                            self.exif.shutter = value
-                        if decode == "DateTime":
-                            self.datetime = datetime.datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-
-                    self.description = self.datetime
+            # the thumbnails are made from the same image if there is no smaller preview for them
+            source = self._choosePreview(candidates, img.size, max_dimension=conf.medium_size,
+                                         min_dimension=self.BIG_THUMB_SIZE[0])
 
-        except IOError:
-            logger.error("IOError", )
+            if source is None:
+                if conf.draft:
+                    self._draft(img, resize_big)
+
+                img.load()
+                source = img
+
+            if resize_big:
+                self.big, resized = self.resize(source, conf.big_size, original)
+                source = self._cascade(source, resized, conf.medium_size, self.BIG_THUMB_SIZE[0])
+            else:
+                self.big = original
+
+            self.medium, resized = self.resize(source, conf.medium_size, original)
+            source = self._cascade(source, resized, min_dimension=self.BIG_THUMB_SIZE[0])
+            source = self._choosePreview(candidates, img.size, source, min_dimension=self.BIG_THUMB_SIZE[0])
+
+            self.thumbnailx2, resized = self.generateThumbnail(source, self.BIG_THUMB_SIZE)
+            source = self._cascade(source, resized, min_dimension=self.SMALL_THUMB_SIZE[0])
+            source = self._choosePreview(candidates, img.size, source, min_dimension=self.SMALL_THUMB_SIZE[0])
+
+            self.thumbnail, _ = self.generateThumbnail(source, self.SMALL_THUMB_SIZE)
+        finally:
+            for preview in candidates:
+                preview.close()
+
+
+    def _openPreviews(self, previews, size):
+        """
+        Open the previews derivatives can be made from with the same result as from the source photo. The preview must
+        have the aspect ratio of the source photo, so cropped, edited or rotated previews are not used. Previews are
+        only opened, they are decoded once they are chosen for a derivative
+        :param previews: paths to pre-rendered previews of the source photo
+        :param size: size of the source photo
+        :return: a list of opened PIL images of the suitable previews, the smallest first
+        """
+        width, height = size
+        result = []
+
+        for path in previews:
+            try:
+                preview = Image.open(path)
+            except IOError:
+                continue
+
+            preview_width, preview_height = preview.size
+
+            # allow for a pixel of rounding error
+            if abs(preview_width * height - preview_height * width) > max(width, height):
+                preview.close()
+                continue
+
+            result.append(preview)
+
+        result.sort(key=lambda preview: preview.size[0])
+        return result
+
+
+    def _choosePreview(self, previews, size, source=None, max_dimension=0, min_dimension=0):
+        """
+        Choose the image a derivative is made from: the smallest preview, which is either as big as the source photo or
+        big enough for the derivative, unless the image the previous derivative was made from is smaller still
+        :param previews: opened previews of the source photo, the smallest first
+        :param size: size of the source photo
+        :param source: image the previous derivative was made from, if there is one
+        :param max_dimension: the biggest dimension required by the derivative
+        :param min_dimension: the smallest dimension required by the derivative
+        :return: the chosen image or None if there is neither a suitable preview nor a previous image
+        """
+        max_dimension = min(max_dimension, max(size))
+        min_dimension = min(min_dimension, min(size))
+
+        for preview in previews:
+            if source is not None and preview.size[0] >= source.size[0]:
+                break
+
+            if max(preview.size) >= max_dimension and min(preview.size) >= min_dimension:
+                logger.debug("Using {} preview {} for {}".format(preview.size, preview.filename, self.originalname))
+                return preview
+
+        return source
+
+
+    def _readRawPreview(self, source):
+        """
+        Read the biggest JPEG preview embedded in a RAW source photo. RAW data is never decoded
+        :param source: the source photo file or its memory mapping
+        :return: the JPEG data of the preview
+        """
+        data = tiff.embedded_jpeg(self.srcfullpath, source)
+        if data is None:
+            raise IOError("No embedded JPEG preview found in {}".format(self.srcfullpath))
+
+        return data
 
-        self.thumbnailfullpath = self.generateThumbnail(self.SMALL_THUMB_SIZE)
-        self.thumbnailx2fullpath = self.generateThumbnail(self.BIG_THUMB_SIZE)
-        self.medium_path = self.resize(conf.medium_size)
 
-        if "big_size" in dir(conf):
-            self.big_path = self.resize(conf.big_size)
+    def _draft(self, img, resize_big=True):
+        """
+        Let the JPEG decoder use DCT scaling to decode the photo at 1/2, 1/4 or 1/8 of its size, as long as the
+        decoded image is still big enough for all the derivatives. Has no effect on formats other than JPEG.
+        :param img: opened, but not yet loaded PIL image of the source photo
+        :param resize_big: False if the big picture is not made from the image
+        """
+        if resize_big and "big_size" in dir(conf):
+            if conf.full_big:
+                return
+            max_dimension = max(conf.big_size, conf.medium_size)
         else:
-            self.big_path = self.srcfullpath
+            max_dimension = conf.medium_size
 
-        # Generate SHA1 hash
-        self.checksum = self.generateHash(self.srcfullpath)
+        width, height = img.size
+        ratio = max(float(max_dimension) / max(width, height), float(self.BIG_THUMB_SIZE[0]) / min(width, height))
 
+        if ratio < 1:
+            img.draft(img.mode, (int(math.ceil(ratio * width)), int(math.ceil(ratio * height))))
+            logger.debug("Decoding {} at {}x{}".format(self.originalname, img.size[0], img.size[1]))
 
-    def resize(self, size):
-        with tempfile.NamedTemporaryFile(delete=False) as temp_image:
 
-            img = Image.open(self.srcfullpath)
-            max_dimension = max(img.size[0], img.size[1])
+    def _cascade(self, source, resized, max_dimension=0, min_dimension=0):
+        """
+        Choose the image the next, smaller derivatives are made from. The resized image is used only if it is big
+        enough to produce all the remaining derivatives without losing detail compared to the source.
+        :param source: image the last derivative was made from
+        :param resized: the last derivative
+        :param max_dimension: the biggest dimension required by the remaining derivatives
+        :param min_dimension: the smallest dimension required by the remaining derivatives
+        :return: the image to make the next derivative from
+        """
+        max_dimension = min(max_dimension, max(source.size))
+        min_dimension = min(min_dimension, min(source.size))
 
-            if size < max_dimension:
-                ratio = float(size) / max_dimension
-                new_size = tuple(int(ratio * size) for size in img.size)
-                logger.debug("Original size: {}x{}; New size: {}x{}".format(img.size[0], img.size[1], new_size[0], new_size[1]))
+        if max(resized.size) >= max_dimension and min(resized.size) >= min_dimension:
+            return resized
+        else:
+            return source
 
-                resized_img = img.resize(new_size, Image.ANTIALIAS)
-                resized_img.save(temp_image.name, "JPEG", quality=conf.quality)
 
-                return temp_image.name
-            else:
-                logger.debug("No resize needed. Image unchanged")
-                return self.srcfullpath
+    def resize(self, img, size, original=None):
+        """
+        Resize an image, so that its biggest dimension does not exceed the given size
+        :param img: PIL image to resize
+        :param size: maximum dimension in pixels
+        :param original: the Derivative used if no resize is needed. The source photo by default
+        :return: tuple of the resized Derivative and the resized image itself. If no resize is needed, then the
+                 original and the unchanged image are returned
+        """
+        max_dimension = max(img.size[0], img.size[1])
 
+        if size < max_dimension:
+            ratio = float(size) / max_dimension
+            new_size = tuple(int(ratio * dimension) for dimension in img.size)
+            logger.debug("Original size: {}x{}; New size: {}x{}".format(img.size[0], img.size[1], new_size[0], new_size[1]))
 
-    def generateThumbnail(self, res):
+            resized_img = img.resize(new_size, Image.ANTIALIAS)
+            return self._save(resized_img), resized_img
+        else:
+            logger.debug("No resize needed. Image unchanged")
+            return original or Derivative(self.srcfullpath), img
+
+
+    def generateThumbnail(self, img, res):
         """
         Create the thumbnail of a given photo
         Parameters:
+        - img: PIL image to make the thumbnail from
         - res: should be a set of h and v res (640, 480)
-        Returns the fullpath of the thuumbnail
+        Returns a tuple of the thumbnail Derivative and the thumbnail image
         """
+        width, height = img.size
 
-        if self.width > self.height:
-            delta = self.width - self.height
+        if width > height:
+            delta = width - height
             left = int(delta / 2)
             upper = 0
-            right = self.height + left
-            lower = self.height
+            right = height + left
+            lower = height
         else:
-            delta = self.height - self.width
+            delta = height - width
             left = 0
             upper = int(delta / 2)
-            right = self.width
-            lower = self.width + upper
+            right = width
+            lower = width + upper
+
+        thumbnail = img.crop((left, upper, right, lower))
+        thumbnail.thumbnail(res, Image.ANTIALIAS)
+        return self._save(thumbnail), thumbnail
+
+
+    def _save(self, img):
+        """
+        Encode a derivative image as JPEG. In the in-memory mode the image is kept in a memory buffer unless it is
+        bigger than conf.memory_limit, otherwise it is saved into a temporary file
+        :param img: PIL image to save
+        :return: a Derivative object
+        """
+        if conf.in_memory:
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=conf.quality)
+            return self._store(buf.getvalue())
 
         tempimage = tempfile.NamedTemporaryFile(delete=False)
         destimage = tempimage.name
         tempimage.close()
 
-        img = Image.open(self.srcfullpath)
-        img = img.crop((left, upper, right, lower))
-        img.thumbnail(res, Image.ANTIALIAS)
         img.save(destimage, "JPEG", quality=conf.quality)
-        return destimage
+        return Derivative(destimage, temporary=True)
+
+
+    def _store(self, data):
+        """
+        Keep an encoded derivative in memory in the in-memory mode unless it is bigger than conf.memory_limit,
+        otherwise write it into a temporary file
+        :param data: the encoded image
+        :return: a Derivative object
+        """
+        if conf.in_memory and len(data) <= conf.memory_limit:
+            return Derivative(data=data)
+
+        with tempfile.NamedTemporaryFile(delete=False) as tempimage:
+            tempimage.write(data)
+            return Derivative(tempimage.name, temporary=True)
 
 
     def cleanup(self):
         """
-        Delete thumbnail files from the local disk. Called after the photo was successfully uploaded.
+        Delete generated derivatives from the local disk or memory. Called after the photo was uploaded.
+        """
+        for derivative in (self.big, self.medium, self.thumbnailx2, self.thumbnail):
+            try:
+                derivative.cleanup()
+            except Exception:
+                logger.error("Cannot delete thumbnail {}".format(derivative.path), exc_info=True)
+
+
+    @staticmethod
+    def generateHash(filePath, source=None):
+        """
+        Compute the SHA1 checksum of a file. The file is read in chunks, so it is never held in memory as a whole
+        :param filePath: path to the file
+        :param source: a memory mapping of the file, if it is mapped already. It is hashed without reading the file
+        :return: the checksum as a hex string
         """
-        try:
-            os.remove(self.medium_path)
-            os.remove(self.thumbnailfullpath)
-            os.remove(self.thumbnailx2fullpath)
-        except Exception:
-            logger.error("Cannot delete thumbnail {}".format(self.thumbnailfullpath), exc_info=True)
-
-
-    def rotatephoto(self, photo, rotation):
-        # rotate main photo
-        img = Image.open(photo.destfullpath)
-        img2 = img.rotate(rotation)
-        img2.save(photo.destfullpath, quality=99)
-        # rotate Thumbnails
-        img = Image.open(photo.thumbnailx2fullpath)
-        img2 = img.rotate(rotation)
-        img2.save(photo.thumbnailx2fullpath, quality=99)
-        img = Image.open(photo.thumbnailfullpath)
-        img2.rotate(rotation)
-        img2.save(photo.thumbnailfullpath, quality=99)
-
-    def adjustRotation(self, photo):
-        """
-        Rotates photos according to the exif orienttaion tag
-        Returns nothing
-        """
-        if photo.exif.orientation not in (0, 1):
-            # There is somthing to do
-            if photo.exif.orientation == 6:
-                # rotate 90° clockwise
-                # AND LOOSE EXIF DATA
-                self.rotatephoto(photo, -90)
-            if photo.exif.orientation == 8:
-                # rotate 90° counterclockwise
-                # AND LOOSE EXIF DATA
-                self.rotatephoto(photo, 90)
-
-
-    def generateHash(self, filePath):
         sha1 = hashlib.sha1()
 
+        if isinstance(source, mmap.mmap):
+            sha1.update(source)
+            return sha1.hexdigest()
+
         with open(filePath, 'rb') as f:
-            sha1.update(f.read())
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), ""):
+                sha1.update(chunk)
             return sha1.hexdigest()
 
 
@@ -260,8 +600,8 @@ class LycheePhoto:
             res += "id:" + str(self.id) + "\n"
             #res += "albumname:" + str(self.albumname) + "\n"
             res += "albumid:" + str(self.albumid) + "\n"
-            res += "thumbnailfullpath:" + str(self.thumbnailfullpath) + "\n"
-            res += "thumbnailx2fullpath:" + str(self.thumbnailx2fullpath) + "\n"
+            res += "thumbnail:" + str(self.thumbnail.path) + "\n"
+            res += "thumbnailx2:" + str(self.thumbnailx2.path) + "\n"
             res += "title:" + str(self.title) + "\n"
             res += "description:" + str(self.description) + "\n"
             res += "url:" + str(self.url) + "\n"
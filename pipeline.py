@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import Queue
+import logging
+
+from conf import conf
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    A step of the pipeline. Items are taken from the input queue of the stage, processed by a function in one or more
+    worker threads and the results are passed to the next stage.
+    """
+
+    def __init__(self, name, function, workers=1):
+        """
+        :param name: name of the stage used in log messages
+        :param function: a function taking an item and returning the item for the next stage or None to drop it
+        :param workers: number of worker threads
+        """
+        self.name = name
+        self.function = function
+        self.workers = max(workers, 1)
+
+
+class Pipeline:
+    """
+    Run items through a sequence of stages connected with bounded queues. Every stage has its own worker threads, so
+    the stages work concurrently, while the bounded queues keep a fast stage from running too far ahead of a slow
+    one. Items produced by the source iterable are passed to the first stage as soon as they are available.
+    """
+
+    _DONE = object()  # Sentinel marking the end of the input of a stage
+
+
+    def __init__(self, queue_size=16):
+        """
+        :param queue_size: maximum number of items waiting in front of every stage
+        """
+        logger.setLevel(conf.verbose)
+
+        self.queue_size = queue_size
+        self.stages = []
+
+
+    def addStage(self, name, function, workers=1):
+        """
+        Append a stage to the pipeline
+        :param name: name of the stage used in log messages
+        :param function: a function taking an item and returning the item for the next stage or None to drop it
+        :param workers: number of worker threads
+        """
+        self.stages.append(Stage(name, function, workers))
+
+
+    def run(self, source):
+        """
+        Run the pipeline until all items produced by the source are processed by all the stages. Failures of
+        individual items are logged and do not stop the pipeline.
+        :param source: an iterable of items for the first stage. It is consumed in a thread of its own
+        """
+        queues = [Queue.Queue(self.queue_size) for stage in self.stages]
+        threads = [threading.Thread(target=self._produce, args=(source, queues[0], self.stages[0].workers))]
+
+        for index, stage in enumerate(self.stages):
+            if index + 1 < len(self.stages):
+                output, output_workers = queues[index + 1], self.stages[index + 1].workers
+            else:
+                output, output_workers = None, 0
+
+            remaining = [stage.workers]
+            lock = threading.Lock()
+
+            for i in range(stage.workers):
+                threads.append(threading.Thread(target=self._work,
+                                                args=(stage, queues[index], output, output_workers, remaining, lock)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for thread in threads:
+            # join with a timeout, so that the main thread can still be interrupted with Ctrl-C
+            while thread.is_alive():
+                thread.join(0.5)
+
+
+    def _produce(self, source, output, output_workers):
+        try:
+            for item in source:
+                output.put(item)
+        except Exception:
+            logger.error("Enumerating photos failed", exc_info=True)
+        finally:
+            for i in range(output_workers):
+                output.put(self._DONE)
+
+
+    def _work(self, stage, input, output, output_workers, remaining, lock):
+        while True:
+            item = input.get()
+
+            if item is self._DONE:
+                break
+
+            try:
+                result = stage.function(item)
+            except Exception:
+                logger.error("Stage {} failed to process an item".format(stage.name), exc_info=True)
+                continue
+
+            if result is not None and output is not None:
+                output.put(result)
+
+        # the last worker of the stage to finish signals the end of the input to the next stage
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+
+        if last and output is not None:
+            for i in range(output_workers):
+                output.put(self._DONE)
@@ -1 +1,15 @@
 __author__ = 'roman'
+
+from collections import namedtuple
+
+
+# A photo produced by a photo source. Sources generate records one by one as they find photos, so that uploading can
+# start before the whole library is enumerated. Records of an album are generated together, but an album may occur
+# more than once.
+# - album: name of the album, "{unsorted}" for the Unsorted album
+# - path: full path to the photo
+# - size: file size in bytes or None if the source does not know it
+# - mtime: file modification time or None if the source does not know it
+# - previews: paths to pre-rendered previews of the photo, e.g. from an iPhoto or Aperture library
+# - date: date and time the photo was taken or None if the source does not know it. Album dates are computed from it
+PhotoRecord = namedtuple("PhotoRecord", ["album", "path", "size", "mtime", "previews", "date"])
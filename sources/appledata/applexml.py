@@ -17,6 +17,7 @@
 import datetime
 import unicodedata
 from xml import sax
+from xml.parsers import expat
 
 #import sources.tilutil.systemutils as su
 
@@ -138,22 +139,136 @@ class AppleXMLHandler(sax.handler.ContentHandler):
         return self.top_node[0]
 
 
+class AppleXMLParser(object):
+    '''Parses an Apple XML file with expat callbacks. Produces the same data
+    tree as AppleXMLHandler, but expat buffers character data, which is
+    collected in a list instead of being concatenated chunk by chunk, and the
+    callbacks are closures working on local state. Dictionary keys are shared
+    between all the dictionaries, which saves memory on large libraries.
+    '''
+
+    SCALARS = frozenset(("key", "date", "string", "integer", "real", "false",
+                         "true", "data"))
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self):
+        self.top_node = None
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.buffer_size = self.BUFFER_SIZE
+
+        text = []
+        parse_stack = []
+        key = [None]
+        keys = {}
+        scalars = self.SCALARS
+        normalize = unicodedata.normalize
+        join = u"".join
+
+        def add_object(xml_object):
+            '''Adds an object to the current container, which can be a list
+            or a map.
+            '''
+            current_top = parse_stack[-1]
+            if current_top.__class__ is list:
+                current_top.append(xml_object)
+            else:
+                current_top[key[0]] = xml_object
+
+        def start_element(name, _attributes):
+            '''Handles the start of an XML element'''
+            # character data between elements is never used
+            del text[:]
+            if name in scalars:
+                pass
+            elif name == "dict":
+                new_dict = {}
+                add_object(new_dict)
+                parse_stack.append(new_dict)
+            elif name == "array":
+                new_array = []
+                add_object(new_array)
+                parse_stack.append(new_array)
+            elif name == "plist":
+                parse_stack.append([])
+            else:
+                print "unrecognized element in XML data: " + name
+
+        def end_element(name):
+            '''callback for the end of a parsed XML element. Empty elements
+            give None like in the SAX handler, so an empty string element
+            becomes u"None"
+            '''
+            if name == "key":
+                # the same keys repeat for every image, share one string
+                value = join(text) if text else None
+                key[0] = keys.setdefault(value, value)
+            elif name == "string":
+                add_object(normalize("NFC", join(text) if text else u"None"))
+            elif name in ("integer", "real", "date"):
+                add_object(join(text) if text else None)
+            elif name == "true":
+                add_object(True)
+            elif name == "false":
+                add_object(False)
+            elif name == "data":
+                # lines of <data> elements are stripped, see
+                # AppleXMLHandler.characters()
+                if text:
+                    add_object(join(line.strip() for line in
+                                    join(text).splitlines()))
+                else:
+                    add_object(None)
+            elif name == "dict" or name == "array":
+                parse_stack.pop()
+            elif name == "plist":
+                self.top_node = parse_stack.pop()
+            else:
+                print "unrecognized element in XML data: " + name
+            del text[:]
+
+        self.parser.StartElementHandler = start_element
+        self.parser.EndElementHandler = end_element
+        self.parser.CharacterDataHandler = text.append
+
+
+    def parse_file(self, xml_file):
+        '''Parses an open file'''
+        self.parser.ParseFile(xml_file)
+
+
+    def parse_string(self, data):
+        '''Parses a string'''
+        self.parser.Parse(data, True)
+
+
+    def gettopnode(self):
+        '''Returns the root of the parsed data tree'''
+        return self.top_node[0]
+
+
 def read_applexml(filename):
     '''Reads the named file, and parses it as an Apple XML file. Returns the
     top node.'''
-    parser = sax.make_parser()
-    handler = AppleXMLHandler()
-    parser.setContentHandler(handler)
-    parser.setEntityResolver(AppleXMLResolver())
-    parser.parse(filename)
-    return handler.gettopnode()
+    parser = AppleXMLParser()
+    with open(filename, "rb") as xml_file:
+        parser.parse_file(xml_file)
+    return parser.gettopnode()
 
 def read_applexml_string(data):
     '''Parses the data as Apple XML format. Returns the top node.'''
+    parser = AppleXMLParser()
+    parser.parse_string(data)
+    return parser.gettopnode()
+
+def read_applexml_sax(filename):
+    '''Reads the named file with the SAX handler, and parses it as an Apple
+    XML file. Returns the top node. Slower than read_applexml().'''
     parser = sax.make_parser()
+    # do not download the plist DTD referenced in the DOCTYPE
+    parser.setFeature(sax.handler.feature_external_ges, False)
     handler = AppleXMLHandler()
     parser.setContentHandler(handler)
     parser.setEntityResolver(AppleXMLResolver())
-    parser.parseString(data)
+    parser.parse(filename)
     return handler.gettopnode()
-
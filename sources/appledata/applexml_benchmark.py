@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks the expat based Apple XML parser against the SAX handler on a
+synthetic iPhoto library.
+
+Usage: python -m sources.appledata.applexml_benchmark [number of images]
+'''
+
+import os
+import sys
+import time
+import random
+import tempfile
+from xml.sax.saxutils import escape
+
+from sources.appledata import applexml
+
+
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+\t<key>Application Version</key>
+\t<string>9.6.1</string>
+\t<key>Archive Path</key>
+\t<string>/Users/test/Pictures/iPhoto Library.photolibrary</string>
+\t<key>List of Keywords</key>
+\t<dict>
+\t\t<key>1</key>
+\t\t<string>Holiday</string>
+\t</dict>
+\t<key>List of Faces</key>
+\t<dict>
+\t</dict>
+'''
+
+IMAGE = u'''\t\t<key>{id}</key>
+\t\t<dict>
+\t\t\t<key>MediaType</key>
+\t\t\t<string>Image</string>
+\t\t\t<key>Caption</key>
+\t\t\t<string>{caption}</string>
+\t\t\t<key>Comment</key>
+\t\t\t<string></string>
+\t\t\t<key>GUID</key>
+\t\t\t<string>{guid}</string>
+\t\t\t<key>Roll</key>
+\t\t\t<integer>{roll}</integer>
+\t\t\t<key>Rating</key>
+\t\t\t<integer>{rating}</integer>
+\t\t\t<key>ImagePath</key>
+\t\t\t<string>{path}</string>
+\t\t\t<key>OriginalPath</key>
+\t\t\t<string>{path}</string>
+\t\t\t<key>ThumbPath</key>
+\t\t\t<string>{path}.thumb.jpg</string>
+\t\t\t<key>ModDateAsTimerInterval</key>
+\t\t\t<real>{date}</real>
+\t\t\t<key>DateAsTimerInterval</key>
+\t\t\t<real>{date}</real>
+\t\t\t<key>latitude</key>
+\t\t\t<real>{latitude}</real>
+\t\t\t<key>longitude</key>
+\t\t\t<real>{longitude}</real>
+\t\t\t<key>Keywords</key>
+\t\t\t<array>
+\t\t\t\t<string>1</string>
+\t\t\t</array>
+\t\t\t<key>Flagged</key>
+\t\t\t<{flagged}/>
+\t\t\t<key>Data</key>
+\t\t\t<data>
+\t\t\tAQEAAwAAAAIAAAAZAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
+\t\t\tAAAAAA==
+\t\t\t</data>
+\t\t</dict>
+'''
+
+CONTAINER = u'''\t\t<dict>
+\t\t\t<key>{id_key}</key>
+\t\t\t<integer>{id}</integer>
+\t\t\t<key>{name_key}</key>
+\t\t\t<string>{name}</string>
+{extra}\t\t\t<key>{date_key}</key>
+\t\t\t<real>{date}</real>
+\t\t\t<key>KeyList</key>
+\t\t\t<array>
+{keys}\t\t\t</array>
+\t\t</dict>
+'''
+
+
+def write_library(path, images, per_container=50):
+    '''Writes a synthetic iPhoto AlbumData.xml file
+    :param path: path to the file
+    :param images: number of images
+    :param per_container: number of images per event and per album
+    '''
+    rnd = random.Random(images)
+    names = [u"Holiday", u"Café", u"Birthday & party", u"Beach", u"旅行"]
+
+    with open(path, "wb") as f:
+        f.write(HEADER)
+
+        f.write("\t<key>Master Image List</key>\n\t<dict>\n")
+        for i in range(images):
+            f.write(IMAGE.format(
+                id=i, caption=escape(rnd.choice(names)) + u" %d" % i, guid="%032x" % rnd.getrandbits(128),
+                roll=i // per_container, rating=rnd.randint(0, 5),
+                path=u"/Users/test/Pictures/iPhoto Library.photolibrary/Masters/2014/%05d/IMG_%05d.JPG" % (
+                    i // per_container, i),
+                date=400000000 + i * 60.5, latitude=rnd.uniform(-90, 90), longitude=rnd.uniform(-180, 180),
+                flagged=rnd.choice(["true", "false"])).encode("utf-8"))
+        f.write("\t</dict>\n")
+
+        containers = range((images + per_container - 1) // per_container)
+
+        for list_name, id_key, name_key, date_key, extra in (
+                ("List of Albums", "AlbumId", "AlbumName", "ProjectEarliestDateAsTimerInterval",
+                 u"\t\t\t<key>Album Type</key>\n\t\t\t<string>Regular</string>\n"),
+                ("List of Rolls", "RollID", "RollName", "RollDateAsTimerInterval", u"")):
+            f.write("\t<key>%s</key>\n\t<array>\n" % list_name)
+            for c in containers:
+                keys = u"".join(u"\t\t\t\t<string>%d</string>\n" % i
+                                for i in range(c * per_container, min((c + 1) * per_container, images)))
+                f.write(CONTAINER.format(id_key=id_key, id=c, name_key=name_key,
+                                         name=escape(names[c % len(names)]) + u" %d" % c, extra=extra,
+                                         date_key=date_key, date=400000000 + c * 3600, keys=keys).encode("utf-8"))
+            f.write("\t</array>\n")
+
+        f.write("</dict>\n</plist>\n")
+
+
+def _same(a, b):
+    '''Compares two parsed trees, including the types of the values'''
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return sorted(a.keys()) == sorted(b.keys()) and all(type(k1) is type(k2) for k1, k2 in
+                                                           zip(sorted(a.keys()), sorted(b.keys()))) and \
+            all(_same(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _measure(function, path, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = function(path)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    images = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    fd, path = tempfile.mkstemp(suffix=".xml")
+    os.close(fd)
+
+    try:
+        write_library(path, images)
+        print "Synthetic library: {} images, {:.1f} MB".format(images, os.path.getsize(path) / 1024.0 / 1024)
+
+        sax_time, sax_tree = _measure(applexml.read_applexml_sax, path)
+        print "SAX handler:   {:.2f} s".format(sax_time)
+
+        expat_time, expat_tree = _measure(applexml.read_applexml, path)
+        print "expat parser:  {:.2f} s ({:.1f}x)".format(expat_time, sax_time / expat_time)
+
+        if not _same(sax_tree, expat_tree):
+            print "ERROR: parsed trees differ"
+            sys.exit(1)
+        print "Parsed trees are identical"
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -39,9 +39,13 @@ None - should not really happen
 #   limitations under the License.
 
 
+import cPickle
 import datetime
+import gc
+import hashlib
 import os
 import sys
+from multiprocessing.pool import ThreadPool
 
 from sources.appledata import applexml
 #import sources.tilutil.systemutils as sysutils
@@ -71,23 +75,149 @@ def _get_aperture_master_path(preview_path):
     # example).
     folder = os.path.dirname(folder)
     return folder.replace('/Previews/', '/Masters/', 1)
-    
+
+
+class MastersIndex(object):
+    """Index of files in Aperture Masters folders. Every folder is scanned once
+       and its files are mapped by name prefix: a file is listed under every
+       part of its name that is followed by a dot, so "IMG_1.jpg" is found
+       for "IMG_1". Folders can be scanned in parallel in advance."""
+
+    THREADS = 8
+
+    def __init__(self):
+        self._folders = {}
+
+    def _scan(self, folder):
+        """Indexes a folder tree. Returns the folder and its index, or None if
+           the folder does not exist."""
+        if not os.path.isdir(folder):
+            return folder, None
+        index = {}
+        for dir_path, _dir_names, file_names in os.walk(folder):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                start = file_name.find('.')
+                while start != -1:
+                    index.setdefault(file_name[:start], []).append(path)
+                    start = file_name.find('.', start + 1)
+        # files closer to the folder come first
+        for paths in index.values():
+            paths.sort(key=lambda path: (path.count(os.sep), path))
+        return folder, index
+
+    def prefetch(self, folders):
+        """Scans folders in parallel."""
+        folders = [folder for folder in set(folders)
+                   if folder not in self._folders]
+        if not folders:
+            return
+        pool = ThreadPool(self.THREADS)
+        try:
+            for folder, index in pool.imap_unordered(self._scan, folders):
+                self._folders[folder] = index
+        finally:
+            pool.close()
+
+    def get(self, folder):
+        """Returns the index of a folder: a map from name prefixes to lists of
+           paths, or None if the folder does not exist."""
+        if folder not in self._folders:
+            self._folders[folder] = self._scan(folder)[1]
+        return self._folders[folder]
+
+
+class LazyImageMap(object):
+    """A map of image ids to IPhotoImage objects, which are built on first
+       access. Supports the dictionary methods used on images_by_id."""
+
+    def __init__(self, image_data, keyword_map, face_map):
+        self._image_data = image_data or {}
+        self._keyword_map = keyword_map
+        self._face_map = face_map
+        self._images = {}
+        self.masters = None
+
+    def get(self, key, default=None):
+        image = self._images.get(key)
+        if image is None:
+            data = self._image_data.get(key)
+            if data is None:
+                return default
+            image = IPhotoImage(data, self._keyword_map, self._face_map)
+            if self.masters:
+                image.find_aperture_original(self.masters)
+            self._images[key] = image
+            # the raw data is not needed anymore, keep the key only
+            self._image_data[key] = True
+        return image
+
+    def __getitem__(self, key):
+        image = self.get(key)
+        if image is None:
+            raise KeyError(key)
+        return image
+
+    def __contains__(self, key):
+        return key in self._image_data
+
+    def __len__(self):
+        return len(self._image_data)
+
+    def __iter__(self):
+        return iter(self._image_data)
+
+    def keys(self):
+        return self._image_data.keys()
+
+    def values(self):
+        return [self.get(key) for key in self._image_data]
+
+    def built(self):
+        """Returns the images built so far."""
+        return self._images.values()
+
+    def prefetch(self, keys):
+        """Indexes the Aperture master folders of the images, which are
+           not built yet, in parallel. Called before the images of an album
+           are built, so only folders of the exported albums are indexed."""
+        if not self.masters:
+            return
+        paths = [self._image_data[key].get("ImagePath") for key in keys
+                 if key not in self._images and
+                 self._image_data.get(key, True) is not True]
+        self.masters.prefetch(_get_aperture_master_path(path)
+                              for path in paths if path)
+
+
 class IPhotoData(object):
     """top level iPhoto data node."""
 
-    def __init__(self, xml_data, is_aperture):
-        """# call with results of readAppleXML."""
-        self.data = xml_data
+    __slots__ = ("aperture", "lazy", "albums", "face_albums", "keywords",
+                 "face_names", "images_by_id", "root_album", "_rolls",
+                 "images_by_base_name", "images_by_file_name",
+                 "_application_version")
+
+    def __init__(self, xml_data, is_aperture, lazy=False):
+        """# call with results of readAppleXML.
+           In lazy mode images are built only when an album or event they
+           belong to is accessed, so exporting a few albums of a large library
+           does not build every image. Event names and indexes of an image
+           are set once the images of its event are accessed.
+           The raw XML data is not kept, objects keep only the values they
+           use."""
         self.aperture = is_aperture
+        self._application_version = xml_data.get("Application Version")
+        self.lazy = lazy
 
         self.albums = {}
         self.face_albums = None
 
         # Master map of keywords
-        self.keywords = self.data.get("List of Keywords")
+        self.keywords = xml_data.get("List of Keywords")
 
         self.face_names = {}  # Master map of faces
-        face_list = self.data.get("List of Faces")
+        face_list = xml_data.get("List of Faces")
         if face_list:
             for face_entry in face_list.values():
                 face_key = face_entry.get("key")
@@ -96,26 +226,31 @@ class IPhotoData(object):
                 # Other keys in face_entry: image, key image face index,
                 # PhotoCount, Order
 
-        self.images_by_id = {}
-        image_data = self.data.get("Master Image List")
-        if image_data:
-            for key in image_data:
-                image = IPhotoImage(image_data.get(key), self.keywords,
-                                    self.face_names)
-                self.images_by_id[key] = image
+        image_data = xml_data.get("Master Image List")
+        if lazy:
+            self.images_by_id = LazyImageMap(image_data, self.keywords,
+                                             self.face_names)
+        else:
+            self.images_by_id = {}
+            if image_data:
+                for key in image_data:
+                    image = IPhotoImage(image_data.get(key), self.keywords,
+                                        self.face_names)
+                    self.images_by_id[key] = image
 
-        album_data = self.data.get("List of Albums")
+        album_data = xml_data.get("List of Albums")
 
         self.root_album = IPhotoContainer("", "Root", None, None)
         for data in album_data:
-            album = IPhotoAlbum(data, self.images_by_id, self.albums,self.root_album)
+            album = IPhotoAlbum(data, self.images_by_id, self.albums,
+                                self.root_album, lazy)
             self.albums[album.albumid] = album
 
-        roll_data = self.data.get("List of Rolls")
+        roll_data = xml_data.get("List of Rolls")
         self._rolls = {}
         if roll_data:
             for roll in roll_data:
-                roll = IPhotoRoll(roll, self.images_by_id)
+                roll = IPhotoRoll(roll, self.images_by_id, lazy)
                 self._rolls[roll.albumid] = roll
                 self.root_album.addalbum(roll)
 
@@ -144,7 +279,7 @@ class IPhotoData(object):
 
 
     def _getapplicationversion(self):
-        return self.data.get("Application Version")
+        return self._application_version
     applicationVersion = property(_getapplicationversion, doc='iPhoto version')
 
     def _getimages(self):
@@ -201,11 +336,23 @@ class IPhotoData(object):
 
     def load_aperture_originals(self):
         """Attempts to locate the original image files (Masters). Only works if
-           the masters are stored in the library."""
+           the masters are stored in the library. Master folders of the images
+           are indexed in parallel first, so every folder is listed once. In
+           lazy mode originals are located as images are built, and master
+           folders of an album are indexed in parallel before its images are
+           built, so only folders of the exported albums are listed."""
         if not self.aperture:
             return
-        for image in self.images_by_id.values():
-            image.find_aperture_original()
+        masters = MastersIndex()
+        if self.lazy:
+            self.images_by_id.masters = masters
+            images = self.images_by_id.built()
+        else:
+            images = self.images_by_id.values()
+        masters.prefetch(_get_aperture_master_path(image.image_path)
+                         for image in images if image.image_path)
+        for image in images:
+            image.find_aperture_original(masters)
 
         
 
@@ -271,9 +418,16 @@ class IPhotoData(object):
 class IPhotoImage(object):
     """Describes an image in the iPhoto database."""
 
+    __slots__ = ("_caption", "comment", "date", "mod_date", "image_path",
+                 "rating", "gps", "keywords", "originalpath", "roll",
+                 "albums", "faces", "face_rectangles", "event_name",
+                 "event_index", "event_index0", "_movie", "_thumbpath",
+                 "_rotation_is_only_edit")
 
     def __init__(self, data, keyword_map, face_map):
-        self.data = data
+        self._movie = data.get("MediaType") == "Movie"
+        self._thumbpath = data.get("ThumbPath")
+        self._rotation_is_only_edit = data.get("RotationIsOnlyEdit")
         self._caption = xstr(data.get("Caption")).strip()
         self.comment = xstr(data.get("Comment")).strip()
         if data.has_key("DateAsTimerInterval"):
@@ -348,7 +502,7 @@ class IPhotoImage(object):
 
     def ismovie(self):
         """Tests if this image is a movie."""
-        return self.data.get("MediaType") == "Movie"
+        return self._movie
 
     def addalbum(self, album):
         """Adds an album to the list of albums for this image."""
@@ -367,43 +521,32 @@ class IPhotoImage(object):
         return "Hidden" in self.keywords
 
     def _getthumbpath(self):
-        return self.data.get("ThumbPath")
+        return self._thumbpath
     thumbpath = property(_getthumbpath, doc="Path to thumbnail image")
 
     def _getrotationisonlyedit(self):
-        return self.data.get("RotationIsOnlyEdit")
+        return self._rotation_is_only_edit
     rotation_is_only_edit = property(_getrotationisonlyedit,
                                      doc="Rotation is only edit.")
 
-    def _search_for_file(self, folder_path, basename):
-        """Scans recursively through a folder tree and returns the path to the
-           first file it finds that starts with "basename".
-        """
-        for file_name in os.listdir(folder_path):
-            path = os.path.join(folder_path, file_name)
-            if os.path.isdir(path):
-                path = self._search_for_file(path, basename)
-                if path:
-                    return path
-            elif file_name.startswith(basename):
-                return path
-        return None
-        
-    def find_aperture_original(self):
-        """Attempts to locate the Aperture Master image. Works only for .jpg
-           masters that are stored in the Aperture library. Saves the result as
-           originalpath."""
+    def find_aperture_original(self, masters=None):
+        """Attempts to locate the Aperture Master image. Works only for
+           masters that are stored in the Aperture library. A .jpg master in
+           the master folder is preferred, otherwise the first file in the
+           folder tree, whose name starts with the image base name and a dot,
+           is used. Saves the result as originalpath.
+           masters is a MastersIndex shared by all the images."""
+        if masters is None:
+            masters = MastersIndex()
         master_path = _get_aperture_master_path(self.image_path)
-        if not os.path.exists(master_path):
+        index = masters.get(master_path)
+        if index is None:
             return
         basename = os.path.basename(os.path.splitext(self.image_path)[0])
-        file_name = os.path.join(master_path, basename + '.jpg')
-        if os.path.exists(file_name):
-            self.originalpath = file_name
-            return
-        path = self._search_for_file(master_path, basename + '.')
-        if path:
-            self.originalpath = path
+        paths = index.get(basename)
+        if paths:
+            file_name = os.path.join(master_path, basename + '.jpg')
+            self.originalpath = file_name if file_name in paths else paths[0]
             return
         print "No master for " + self.image_path
 
@@ -411,9 +554,14 @@ class IPhotoImage(object):
 class IPhotoContainer(object):
     """Base class for IPhotoAlbum and IPhotoRoll."""
 
-    def __init__(self, name, albumtype, data, images):
+    __slots__ = ("name", "_date", "_date_pending", "albumtype", "_comment",
+                 "albumid", "_images", "_image_map", "_keylist", "albums",
+                 "master")
+
+    def __init__(self, name, albumtype, data, images, lazy=False):
         self.name = name
-        self.date = None
+        self._date = None
+        self._date_pending = False
         # The iPhoto master album has no album type.
         if not albumtype and name == 'Photos':
             albumtype = 'Master'
@@ -450,24 +598,54 @@ class IPhotoContainer(object):
             else:
                 print 'Unknown album type %s for %s.' % (albumtype, name)
         self.albumtype = albumtype
-        self.data = data
+        self._comment = data.get("Comments") if data else None
 
         self.albumid = -1
-        self.images = []
+        self._images = None
+        self._image_map = images
+        self._keylist = None
+        if not self.isfolder() and data and data.has_key("KeyList"):
+            self._keylist = data.get("KeyList")
         self.albums = []
         self.master = False
 
-        if not self.isfolder() and data and data.has_key("KeyList"):
-            keylist = data.get("KeyList")
-            for key in keylist:
-                image = images.get(key)
+        if not lazy:
+            self._loadimages()
+
+    def _loadimages(self):
+        """Resolves the images of this container."""
+        self._images = []
+        if self._keylist:
+            if isinstance(self._image_map, LazyImageMap):
+                self._image_map.prefetch(self._keylist)
+            for key in self._keylist:
+                image = self._image_map.get(key)
                 if image:
-                    self.images.append(image)
+                    self._images.append(image)
                 else:
-                    print "%s: image with id %s does not exist." % (name, key)
+                    print "%s: image with id %s does not exist." % (self.name,
+                                                                    key)
+        self._image_map = None
+        self._keylist = None
+
+    def _getimages(self):
+        if self._images is None:
+            self._loadimages()
+        return self._images
+    images = property(_getimages, doc="List of images")
+
+    def _getdate(self):
+        if self._date_pending:
+            self._date_pending = False
+            self.find_oldest_date()
+        return self._date
+
+    def _setdate(self, date):
+        self._date = date
+    date = property(_getdate, _setdate, doc="Date of the album or event")
 
     def _getcomment(self):
-        return self.data.get("Comments")
+        return self._comment
     comment = property(_getcomment, doc='comments (description)')
 
     def _getsize(self):
@@ -517,23 +695,28 @@ class IPhotoContainer(object):
 class IPhotoRoll(IPhotoContainer):
     """Describes an iPhoto Roll or Event."""
 
-    def __init__(self, data, images):
+    __slots__ = ()
+
+    def __init__(self, data, images, lazy=False):
         IPhotoContainer.__init__(self,
                                  data.get("RollName")
                                  if data.has_key("RollName")
                                  else data.get("AlbumName"),
-                                 "Event", data, images)
+                                 "Event", data, images, lazy)
         self.albumid = data.get("RollID")
         if not self.albumid:
             self.albumid = data.get("AlbumId")
-        self.date = applexml.getappletime(self.data.get(
+        self.date = applexml.getappletime(data.get(
             "RollDateAsTimerInterval"))
         if not self.date:
-            self.date = applexml.getappletime(self.data.get(
+            self.date = applexml.getappletime(data.get(
                 'ProjectEarliestDateAsTimerInterval'))
+
+    def _loadimages(self):
+        IPhotoContainer._loadimages(self)
         i = 1
-        index_digits = len(str(len(self.images)))
-        for image in self.images:
+        index_digits = len(str(len(self._images)))
+        for image in self._images:
             image.event_name = self.name
             image.event_index = i
             image.event_index0 = str(i).zfill(index_digits)
@@ -543,10 +726,12 @@ class IPhotoRoll(IPhotoContainer):
 class IPhotoAlbum(IPhotoContainer):
     """Describes an iPhoto Album."""
 
-    def __init__(self, data, images, album_map, root_album):
+    __slots__ = ("parent",)
+
+    def __init__(self, data, images, album_map, root_album, lazy=False):
         IPhotoContainer.__init__(self, data.get("AlbumName"),
                                  data.get("Album Type"),
-                                 data, images)
+                                 data, images, lazy)
         self.albumid = data.get("AlbumId")
         if data.has_key("Master"):
             self.master = True
@@ -561,12 +746,19 @@ class IPhotoAlbum(IPhotoContainer):
                     self.name, parent_id)
         if self.parent:
             self.parent.addalbum(self)
-        self.find_oldest_date()
+        if lazy:
+            # computed from images on first access
+            self._date_pending = True
+        else:
+            self.find_oldest_date()
 
 
 class IPhotoFace(object):
     """An IPhotoContainer compatible class for a face."""
 
+    __slots__ = ("name", "albumtype", "albumid", "images", "albums",
+                 "comment", "date")
+
     def __init__(self, face):
         self.name = face
         self.albumtype = "Face"
@@ -617,13 +809,83 @@ def get_album_xmlfile(library_dir):
                        "library location.") % (library_dir)
 
 
-def get_iphoto_data(album_xml_file):
-    """reads the iPhoto database and converts it into an iPhotoData object."""
+# Bump when the classes stored in snapshots change, so that old snapshots are
+# not loaded.
+SNAPSHOT_VERSION = 4
+
+
+def _snapshot_key(album_xml_file, lazy):
+    """Returns the key identifying the version of a library file a snapshot was
+       taken of."""
+    stat = os.stat(album_xml_file)
+    return (SNAPSHOT_VERSION, os.path.abspath(album_xml_file), stat.st_size,
+            stat.st_mtime, lazy)
+
+
+def _snapshot_path(snapshot_dir, album_xml_file):
+    """Returns the path to the snapshot of a library file."""
+    name = hashlib.sha1(os.path.abspath(album_xml_file)).hexdigest()
+    return os.path.join(os.path.expanduser(snapshot_dir), name + ".pickle")
+
+
+def _load_snapshot(path, key):
+    """Loads an IPhotoData snapshot. Returns None if there is no snapshot or it
+       was taken of a different version of the library file."""
+    try:
+        with open(path, "rb") as snapshot:
+            unpickler = cPickle.Unpickler(snapshot)
+            if unpickler.load() != key:
+                return None
+            # the collector only slows down loading of a large object graph
+            gc.disable()
+            try:
+                return unpickler.load()
+            finally:
+                gc.enable()
+    except (IOError, EOFError, cPickle.UnpicklingError, ValueError,
+            AttributeError, ImportError):
+        return None
+
+
+def _save_snapshot(path, key, data):
+    """Saves an IPhotoData snapshot. The key is written first, so that stale
+       snapshots are rejected without being loaded."""
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + ".tmp", "wb") as snapshot:
+            pickler = cPickle.Pickler(snapshot, cPickle.HIGHEST_PROTOCOL)
+            pickler.dump(key)
+            pickler.dump(data)
+        os.rename(path + ".tmp", path)
+    except (IOError, OSError, cPickle.PicklingError), e:
+        print >> sys.stderr, "Failed to save library snapshot: %s" % e
+
+
+def get_iphoto_data(album_xml_file, snapshot_dir=None, lazy=False):
+    """reads the iPhoto database and converts it into an iPhotoData object.
+       If snapshot_dir is given, the parsed data is kept there and reused
+       while the library file does not change. In lazy mode images are built
+       on demand, see IPhotoData."""
     library_dir = os.path.dirname(album_xml_file)
-    print "Reading iPhoto database from " + library_dir + "..."
-    album_xml = applexml.read_applexml(album_xml_file)
+    data = None
+
+    if snapshot_dir:
+        snapshot_path = _snapshot_path(snapshot_dir, album_xml_file)
+        snapshot_key = _snapshot_key(album_xml_file, lazy)
+        data = _load_snapshot(snapshot_path, snapshot_key)
+
+    if data is None:
+        print "Reading iPhoto database from " + library_dir + "..."
+        album_xml = applexml.read_applexml(album_xml_file)
+
+        data = IPhotoData(album_xml,
+                          album_xml_file.endswith('ApertureData.xml'), lazy)
+        if snapshot_dir:
+            _save_snapshot(snapshot_path, snapshot_key, data)
+    else:
+        print "Loaded iPhoto database snapshot of " + library_dir
 
-    data = IPhotoData(album_xml, album_xml_file.endswith('ApertureData.xml'))
     if data.aperture:
         if not data.applicationVersion.startswith('3.'):
             raise ValueError, "Aperture version %s not supported" % (
@@ -642,6 +904,8 @@ def get_iphoto_data(album_xml_file):
 class GpsLocation(object):
     """Tracks a Gps location (without altitude), as latitude and longitude.
     """
+
+    __slots__ = ("latitude", "longitude")
     # How much rounding "error" do we allow for two GPS coordinates
     # to be considered identical.
     _MIN_GPS_DIFF = 0.0000007
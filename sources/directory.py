@@ -1,38 +1,205 @@
 import os
+import json
+import time
+import logging
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # backport for Python 2
+    except ImportError:
+        scandir = None
 
 from conf import *
+from sources import PhotoRecord
+
+logger = logging.getLogger(__name__)
 
 
 def get_photos():
     """
-    Scan photos in the provided directory and create a dictionary dict[albumname] = [photo_paths,], where
-    album names correspond to folders. Sub-folders are converted to regular albums, as Lychee does not support
-    sub-albums. Files in the root directory are put into the Unsorted album ("{unsorted}" is the key name).
+    Scan photos in the provided directory and generate a PhotoRecord for every photo, where album names correspond to
+    folders. Sub-folders are converted to regular albums, as Lychee does not support sub-albums. Files in
+    the root directory are put into the Unsorted album ("{unsorted}" is the album name).
+
+    Directories are listed in parallel by conf.scan_threads threads one tree level at a time and photos are generated
+    as soon as their directories are listed. Sizes and modification times of photos are read by the same threads, photos
+    themselves are never opened. If conf.scan_cache is set, then contents of every directory are stored in the scan
+    cache with the directory modification time. On following runs directories whose modification time has not changed
+    are not listed again, their photos are only stat'ed for their sizes and modification times.
 
-    :return: dictionary with album names and image paths.
+    :return: generator of PhotoRecord tuples.
     """
+    logger.setLevel(conf.verbose)
+
+    root = os.path.abspath(conf.dir)
+    cache = _load_cache(root)
+    scanned = {}
+
+    pool = ThreadPool(conf.scan_threads)
+    level = [""]
+
+    try:
+        while level:
+            next_level = []
 
-    albums = {}
-    # walk through each file / dir of the srcdir
-    for root, dirs, files in os.walk(conf.dir):
+            for rel_path, entry, photos in pool.imap_unordered(lambda rel_path: _scan_dir(root, rel_path, cache),
+                                                               level):
+                if entry is None:
+                    continue
 
-        # if a there is at least one photo in the files
-        if any([_isphoto(f) for f in files]):
-            rel_path = os.path.relpath(root, conf.dir)
+                if conf.scan_cache:
+                    scanned[rel_path] = entry
+                next_level.extend(os.path.join(rel_path, d) for d in entry[2])
 
-            if root == conf.dir:
-                album_name = "{unsorted}"
-            else:
-                album_name = _get_album_name(rel_path)
+                if rel_path == "":
+                    album_name = "{unsorted}"
+                else:
+                    album_name = _get_album_name(rel_path)
 
-            albums[album_name] = []
+                for full_path, size, mtime in photos:
+                    yield PhotoRecord(album_name, full_path, size, mtime, (), None)
 
-            for f in files:
-                if _isphoto(f):
-                    full_path = os.path.join(root, f)
-                    albums[album_name].append(full_path)
+            level = next_level
+    finally:
+        pool.close()
 
-    return albums
+    _save_cache(root, scanned)
+
+
+def _scan_dir(root, rel_path, cache):
+    """
+    List photos and sub-directories of a directory, or take them from the scan cache if the directory has not been
+    modified since it was cached
+    :param root: the photo directory
+    :param rel_path: path of the directory relative to the root
+    :param cache: a dictionary of cached directory entries
+    :return: a tuple of the relative path, a (modification time, [photo names], [sub-directory names]) tuple or
+             None if the directory cannot be read and a list of (full path, size, modification time) tuples of photos
+    """
+    path = os.path.join(root, rel_path)
+
+    try:
+        mtime = os.stat(path).st_mtime
+
+        cached = cache.get(rel_path)
+        if cached and cached[0] == mtime:
+            return rel_path, cached, _stat_photos(path, cached[1])
+
+        photos, dirs = [], []
+
+        if scandir:
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif _isphoto(entry.name):
+                    photos.append(entry.name)
+        else:
+            for name in os.listdir(path):
+                full_path = os.path.join(path, name)
+                if os.path.isdir(full_path) and not os.path.islink(full_path):
+                    dirs.append(name)
+                elif _isphoto(name):
+                    photos.append(name)
+    except OSError:
+        logger.warning("Cannot read directory {}".format(path), exc_info=True)
+        return rel_path, None, []
+
+    photos.sort()
+    return rel_path, (mtime, photos, dirs), _stat_photos(path, photos)
+
+
+def _stat_photos(path, photos):
+    """
+    Read sizes and modification times of photos in a directory. Photos that disappeared since the directory was listed
+    are left out
+    :param path: path to the directory
+    :param photos: a list of photo names
+    :return: a list of (full path, size, modification time) tuples
+    """
+    result = []
+
+    for file_name in photos:
+        full_path = os.path.join(path, file_name)
+
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            continue
+
+        result.append((full_path, stat.st_size, stat.st_mtime))
+
+    return result
+
+
+def _load_cache(root):
+    """
+    Load cached directory entries of the photo directory
+    :param root: the photo directory
+    :return: a dictionary of relative paths and (modification time, [photo names], [sub-directory names]) tuples
+    """
+    if not conf.scan_cache:
+        return {}
+
+    try:
+        with open(os.path.expanduser(conf.scan_cache)) as f:
+            cache = json.load(f).get(_cache_key(root), {})
+    except (IOError, ValueError):
+        return {}
+
+    # entries written by some older versions carry photo dates, which are not used anymore
+    cache = dict((rel_path, entry[:3]) for rel_path, entry in cache.items())
+
+    if isinstance(root, str):  # keep paths as byte strings, like os.listdir does
+        cache = dict((rel_path.encode("utf-8"), (mtime, [f.encode("utf-8") for f in photos],
+                                                 [d.encode("utf-8") for d in dirs]))
+                     for rel_path, (mtime, photos, dirs) in cache.items())
+
+    return cache
+
+
+def _save_cache(root, scanned):
+    """
+    Store directory entries of the photo directory in the scan cache. Directories modified within the last few seconds
+    are not stored, as their modification time might not change after another update due to the timestamp resolution
+    :param root: the photo directory
+    :param scanned: a dictionary of relative paths and (modification time, [photo names], [sub-directory names]) tuples
+    """
+    if not conf.scan_cache:
+        return
+
+    path = os.path.expanduser(conf.scan_cache)
+    threshold = time.time() - 2
+
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, ValueError):
+        data = {}
+
+    data[_cache_key(root)] = dict((rel_path, entry) for rel_path, entry in scanned.items() if entry[0] < threshold)
+
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.rename(path + ".tmp", path)
+    except (IOError, OSError, ValueError):
+        logger.warning("Cannot save the scan cache to {}".format(path), exc_info=True)
+
+
+def _cache_key(root):
+    """
+    Get the key the photo directory is stored under in the scan cache. Paths, which are not valid UTF-8, get replacement
+    characters, so they never fail the scan
+    :param root: the photo directory
+    :return: the key as a unicode string
+    """
+    return root.decode("utf-8", "replace") if isinstance(root, str) else root
 
 
 def _get_album_name(rel_path):
@@ -48,8 +215,7 @@ def _isphoto(file):
     Determine if a provided file is an image based on its extension
     :return: True if the file is an image. False otherwise
     """
-    validimgext = ['.jpg', '.jpeg', '.gif', '.png']
+    validimgext = ['.jpg', '.jpeg', '.gif', '.png', '.cr2', '.nef', '.arw', '.dng']
     ext = os.path.splitext(file)[-1].lower()
     return (ext in validimgext)
 
-
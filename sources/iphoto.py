@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-"""Reads iPhoto library info, and produces a dictionary of albums and image paths."""
+"""Reads iPhoto library info, and produces a stream of albums and image paths."""
 
 #  Copyright 2014 Roman Sirokov
 #  Copyright 2010 Google Inc.
@@ -19,6 +19,7 @@
 
 import re
 from sources.appledata import iphotodata
+from sources import PhotoRecord
 from conf import *
 
 logger = logging.getLogger(__name__)
@@ -28,12 +29,13 @@ logger = logging.getLogger(__name__)
 class IphotoLibrary(object):
     """The class that represents iPhoto / Aperture library"""
 
-    def __init__(self, aperture, xml_file, exclude, originals):
-        self.data = iphotodata.get_iphoto_data(xml_file)
+    def __init__(self, aperture, xml_file, exclude, originals, previews=False):
+        # only images of exported albums are built
+        self.data = iphotodata.get_iphoto_data(xml_file, conf.library_cache, lazy=True)
         self.exclude = exclude
         self.originals = originals
+        self.previews = previews
         self._abort = False
-        self.exported_photos = {}
 
         if aperture:
             self.data.load_aperture_originals()
@@ -57,7 +59,7 @@ class IphotoLibrary(object):
     def export_events(self, pattern):
         """ Export events according to a regex pattern.
         :param pattern: Regex pattern. Use "." to export all events
-        :return: Dictionary of albums and image paths
+        :return: generator of album names and lists of image paths, previews and dates
         """
         return self._process_albums(self.data.root_album.albums, ["Event"], pattern)
 
@@ -65,7 +67,7 @@ class IphotoLibrary(object):
     def export_albums(self, pattern):
         """ Export albums according to a regex pattern.
         :param pattern: Regex pattern. Use "." to export all albums
-        :return: Dictionary of albums and image paths
+        :return: generator of album names and lists of image paths, previews and dates
         """
         return self._process_albums(self.data.root_album.albums, ["Regular", "Published"], pattern)
 
@@ -77,7 +79,7 @@ class IphotoLibrary(object):
     def export_smartalbums(self, pattern):
         """ Export smart albums according to a regex pattern.
         :param pattern: Regex pattern. Use "." to export all smart albums
-        :return: Dictionary of albums and image paths
+        :return: generator of album names and lists of image paths, previews and dates
         """
         return self._process_albums(self.data.root_album.albums, ["Smart"], pattern)
 
@@ -85,15 +87,15 @@ class IphotoLibrary(object):
 
     def _process_albums(self, albums, album_types, include, matched=False):
         """
-        The workhorse method of the class. Process iPhoto library files and produce a dictionary of albums and image
-        paths. Since albums can contain other albums, this method is called recursively to process all the data in the
-        library
+        The workhorse method of the class. Process iPhoto library files and generate albums and image paths as they
+        are found. Since albums can contain other albums, this method is called recursively to process all the data in
+        the library
         :param albums: The root of data, from which the search of photos begins
         :param album_types: A list of album types to export. Possible values are ["Event", "Regular", "Published",
                             "Smart"]
         :param include: A Regex pattern of album names to match
         :param matched: Flag indicating that the album is matched
-        :return: a dictionary of album names and image paths
+        :return: a generator of (album name, [(image path, previews, date)]) tuples
         """
         exclude_pattern = None
         if conf.exclude:
@@ -116,7 +118,8 @@ class IphotoLibrary(object):
                 if include_pattern.match(sub_name):
                     sub_matched = True
 
-                self._process_albums(sub_album.albums, album_types, include, sub_matched)
+                for album in self._process_albums(sub_album.albums, album_types, include, sub_matched):
+                    yield album
                 continue
             elif (sub_album.albumtype == "None" or
                   not sub_album.albumtype in album_types):
@@ -135,64 +138,77 @@ class IphotoLibrary(object):
             logger.debug(u'Loading "%s".', sub_name)
 
             # first, do the sub-albums
-            self._process_albums(sub_album.albums, album_types, include, matched) > 0
+            for album in self._process_albums(sub_album.albums, album_types, include, matched):
+                yield album
             # now the album itself
-            if self.originals:
-                self.exported_photos[sub_name] = [image.originalpath or image.image_path for image in sub_album.images]
-            else:
-                self.exported_photos[sub_name] = [image.image_path for image in sub_album.images]
+            yield sub_name, [self._export_image(image) for image in sub_album.images]
 
-        return self.exported_photos
+
+    def _export_image(self, image):
+        """
+        Choose the file to export for an image and its previews
+        :param image: an IPhotoImage object
+        :return: a tuple of the path to the file, a tuple of paths to the previews of the file and the date of the
+                 image. The previews are the thumbnail and, if the original file is exported, the modified image, which
+                 is a full size preview in Aperture libraries
+        """
+        if self.originals:
+            path = image.originalpath or image.image_path
+        else:
+            path = image.image_path
+
+        previews = ()
+        if self.previews:
+            previews = tuple(preview for preview in (image.thumbpath, image.image_path) if preview and preview != path)
+
+        return path, previews, image.date
 
 
 
 def get_photos():
     """
-    Get images from the iPhoto / Aperture library. Parameters are read from the global configuration
-    :return: a dictionary of album names and image paths
+    Get images from the iPhoto / Aperture library. Parameters are read from the global configuration. Albums are
+    generated as the library is traversed. Albums with the same name are renamed, so that they are not merged in Lychee
+    :return: a generator of PhotoRecord tuples
     """
 
-    def add_albums(pattern, export_photos):
+    def unique_name(name):
         """
-        A helper function that exports photos from the library and resolves name conflicts before adding albums to the
-        export dictionary
-        :param pattern: A Regex pattern of album names to match
-        :param export_photos: a dictionary, which exported photos are added to
-        :return:
+        A helper function that resolves name conflicts of exported albums
+        :param name: name of the album
+        :return: the name or the name with an index, if an album with the same name was exported before
         """
-        photos = library.export_albums(pattern)
-
-        for key in set(photos) & set(export_photos): # Check that keys do not conflict
-            logger.debug("Conflicting album found {}".format(key))
-            index = 1
-            while True:
-                new_key = key + u" ({})".format(index)
-                if new_key in export_photos:
-                    index += 1
-                else:
-                    break
+        new_name = name
+        index = 1
+        while new_name in exported:
+            logger.debug("Conflicting album found {}".format(new_name))
+            new_name = name + u" ({})".format(index)
+            index += 1
 
-            photos[new_key] = photos.pop(key)
+        exported.add(new_name)
+        return new_name
 
-        export_photos.update(photos)
-        return export_photos
-
-    library = IphotoLibrary(conf.source == "Aperture", conf.xmlsource, conf.exclude, conf.originals)
+    library = IphotoLibrary(conf.source == "Aperture", conf.xmlsource, conf.exclude, conf.originals, conf.previews)
 
     print "Scanning iPhoto data for photos to export..."
-    export_photos = {}
+    exports = []
     if "events" in dir(conf):
-        export_photos = library.export_events(conf.events)
+        exports.append(library.export_events(conf.events))
 
     if "albums" in dir(conf):
-        export_photos = add_albums(conf.albums, export_photos)
+        exports.append(library.export_albums(conf.albums))
 
     if "smarts" in dir(conf):
-        export_photos = add_albums(conf.smarts, export_photos)
+        exports.append(library.export_smartalbums(conf.smarts))
 
     if "facealbums" in dir(conf):
-        photos = library.export_facealbums()
-        export_photos.update(photos)
+        exports.append(library.export_facealbums())
+
+    exported = set()
+    for export in exports:
+        for album_name, images in export:
+            album_name = unique_name(album_name)
 
-    return export_photos
+            for path, previews, date in images:
+                yield PhotoRecord(album_name, path, None, None, previews, date)
 
@@ -1,9 +1,12 @@
 
 import paramiko
 import getpass
+import errno
 import os
 import socket
 import re
+import Queue
+from multiprocessing.pool import ThreadPool
 
 from conf import conf
 
@@ -14,7 +17,8 @@ logger = logging.getLogger(__name__)
 
 class SSH:
     """
-    This class is used to connect to remote host and copy files
+    This class is used to connect to remote host and copy files. Files are transferred over a pool of SFTP channels
+    opened on a single SSH transport, so that several transfers can be in flight at the same time.
     """
 
 
@@ -38,6 +42,12 @@ class SSH:
             try:
                 self._ssh.connect(conf.server, username=conf.username, password=password, port=conf.port)
                 self._ftp = self._ssh.open_sftp()
+
+                self._channels = Queue.Queue()
+                for i in range(conf.connections):
+                    self._channels.put(self._ssh.open_sftp())
+                self._pool = ThreadPool(conf.connections)
+
                 print("Connected to " + conf.server)
 
             except paramiko.AuthenticationException:
@@ -56,6 +66,7 @@ class SSH:
 
     def disconnect(self):
         logger.info("Disconnected from " + conf.server)
+        self._pool.close()
         self._ssh.close()
 
 
@@ -66,26 +77,70 @@ class SSH:
 
     def put(self, source, destination):
         """
-        Upload a file to the remote server
+        Upload a file to the remote server using the first SFTP channel available
+        :param source: path to a local file or a file object to read from
+        :param destination: path to the file on the remote server
+        :return: True if the file was uploaded successfully
         """
-        file_name = os.path.split(source)[-1]
+        file_name = os.path.split(destination)[-1]
+        ftp = self._channels.get()
         try:
-            self._ftp.put(source, destination)
+            if hasattr(source, "read"):
+                ftp.putfo(source, destination)
+            else:
+                ftp.put(source, destination)
             logger.debug("Uploaded file " + file_name)
+            return True
 
-        except paramiko.SSHException as e:
+        except (paramiko.SSHException, IOError) as e:
             logger.error("Error occured while uploading file {}: {}".format(file_name, e), exc_info=True)
+            return False
+        finally:
+            self._channels.put(ftp)
+
+
+    def putAll(self, files):
+        """
+        Upload several files to the remote server in parallel, spreading them over the pool of SFTP channels. Returns
+        when all the transfers are finished
+        :param files: a list of (source, destination) tuples
+        :return: True if all the files were uploaded successfully
+        """
+        results = self._pool.map(lambda (source, destination): self.put(source, destination), files)
+        return all(results)
 
 
-    def remove(self, file_name):
+    def remove(self, file_name, missing_ok=False):
         """
-        Remove file on the remote server
+        Remove file on the remote server using the first SFTP channel available
+        :param missing_ok: if True, a file that does not exist is not an error
+        :return: True if the file was removed successfully
         """
+        ftp = self._channels.get()
         try:
-            self._ftp.remove(file_name)
+            ftp.remove(file_name)
             logger.debug("Removed file " + file_name)
+            return True
+        except IOError as e:
+            if missing_ok and e.errno == errno.ENOENT:
+                return True
+            logger.error("Error occured while removing file {}: {}".format(file_name, e), exc_info=True)
+            return False
         except paramiko.SSHException as e:
             logger.error("Error occured while removing file {}: {}".format(file_name, e), exc_info=True)
+            return False
+        finally:
+            self._channels.put(ftp)
+
+
+    def removeAll(self, file_names, missing_ok=False):
+        """
+        Remove several files on the remote server in parallel
+        :param file_names: a list of paths to files on the remote server
+        :param missing_ok: if True, files that do not exist are not an error
+        :return: True if all the files were removed successfully
+        """
+        return all(self._pool.map(lambda file_name: self.remove(file_name, missing_ok), file_names))
 
 
     def loadDbConfig(self):
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Hand-built binary fixtures: TIFF structures and JPEG headers small enough to be built byte by byte in the tests.
+"""
+
+import struct
+
+# TIFF field types
+BYTE, ASCII, SHORT, LONG, RATIONAL, SRATIONAL = 1, 2, 3, 4, 5, 10
+
+_FORMATS = {BYTE: "B", SHORT: "H", LONG: "I", RATIONAL: "II", SRATIONAL: "ii"}
+
+
+class TiffBuilder(object):
+    """
+    Build a TIFF structure. Data is appended to the end of the file and IFDs are written with their values in place
+    or at an offset, like a TIFF writer would do.
+    """
+
+    def __init__(self, order="<"):
+        """
+        :param order: byte order, "<" for little endian (II) or ">" for big endian (MM)
+        """
+        self.order = order
+        self.data = ("II" if order == "<" else "MM") + struct.pack(order + "HI", 42, 0)
+
+
+    def append(self, blob):
+        """
+        Append data to the file
+        :return: offset of the data
+        """
+        offset = len(self.data)
+        self.data += blob
+        return offset
+
+
+    def addIfd(self, entries, next_ifd=0, first=False):
+        """
+        Append an IFD
+        :param entries: a list of (tag, field type, value) tuples. ASCII values are strings, rational values lists of
+                        (numerator, denominator) tuples and other values lists of integers
+        :param next_ifd: offset of the next IFD
+        :param first: True to make the IFD the first one of the file
+        :return: offset of the IFD
+        """
+        packed = []
+        for tag, field_type, value in sorted(entries):
+            if field_type == ASCII:
+                blob, count = value + "\x00", len(value) + 1
+            elif field_type in (RATIONAL, SRATIONAL):
+                blob = struct.pack(self.order + _FORMATS[field_type] * len(value), *sum(value, ()))
+                count = len(value)
+            else:
+                blob = struct.pack(self.order + _FORMATS[field_type] * len(value), *value)
+                count = len(value)
+
+            if len(blob) > 4:
+                blob = struct.pack(self.order + "I", self.append(blob))
+            packed.append(struct.pack(self.order + "HHI", tag, field_type, count) + blob.ljust(4, "\x00"))
+
+        offset = self.append(struct.pack(self.order + "H", len(packed)) + "".join(packed) +
+                             struct.pack(self.order + "I", next_ifd))
+        if first:
+            self.setFirstIfd(offset)
+        return offset
+
+
+    def setFirstIfd(self, offset):
+        self.data = self.data[:4] + struct.pack(self.order + "I", offset) + self.data[8:]
+
+
+    def patchLong(self, offset, value):
+        """
+        Overwrite a 32 bit value, e.g. to point an IFD to the next one written after it
+        """
+        self.data = self.data[:offset] + struct.pack(self.order + "I", value) + self.data[offset + 4:]
+
+
+    def getvalue(self):
+        return self.data
+
+
+def jpeg(width, height, sof=0xc0, segments=""):
+    """
+    Build the header of a JPEG stream: SOI, an APP0 segment, other segments and a frame header
+    :param sof: the frame marker, 0xc0 for baseline, 0xc2 for progressive or 0xc3 for lossless JPEG
+    :param segments: segments inserted before the frame header
+    """
+    app0 = "\xff\xe0" + struct.pack(">H", 16) + "JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    frame = "\xff" + chr(sof) + struct.pack(">HBHHB", 11, 8, height, width, 1) + "\x01\x11\x00"
+    return "\xff\xd8" + app0 + segments + frame + "\xff\xd9"
+
+
+def app1(tiff_data):
+    """
+    Build an EXIF APP1 segment
+    """
+    payload = "Exif\x00\x00" + tiff_data
+    return "\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sources.appledata import applexml
+
+
+PLIST = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+\t<key>Application Version</key>
+\t<string>9.6.1</string>
+\t<key>Major Version</key>
+\t<integer>2</integer>
+\t<key>Master Image List</key>
+\t<dict>
+\t\t<key>1</key>
+\t\t<dict>
+\t\t\t<key>Caption</key>
+\t\t\t<string>Cafe\xcc\x81 &amp; bar</string>
+\t\t\t<key>Comment</key>
+\t\t\t<string></string>
+\t\t\t<key>DateAsTimerInterval</key>
+\t\t\t<real>458591405.000000</real>
+\t\t\t<key>Rating</key>
+\t\t\t<integer>3</integer>
+\t\t\t<key>Hidden</key>
+\t\t\t<false/>
+\t\t\t<key>Flagged</key>
+\t\t\t<true/>
+\t\t\t<key>Keywords</key>
+\t\t\t<array>
+\t\t\t\t<string>1</string>
+\t\t\t\t<string>2</string>
+\t\t\t</array>
+\t\t\t<key>Thumbnail</key>
+\t\t\t<data>
+\t\t\tAAEC
+\t\t\tAwQF
+\t\t\t</data>
+\t\t</dict>
+\t\t<key>2</key>
+\t\t<dict>
+\t\t\t<key>Caption</key>
+\t\t\t<string>IMG_0002</string>
+\t\t\t<key>Keywords</key>
+\t\t\t<array/>
+\t\t</dict>
+\t</dict>
+\t<key>List of Rolls</key>
+\t<array>
+\t\t<dict>
+\t\t\t<key>RollDate</key>
+\t\t\t<date>2015-07-14T18:30:05Z</date>
+\t\t</dict>
+\t</array>
+</dict>
+</plist>
+'''
+
+
+class AppleXMLParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = applexml.read_applexml_string(PLIST)
+
+    def testValues(self):
+        image = self.data["Master Image List"]["1"]
+
+        self.assertEqual(self.data["Application Version"], u"9.6.1")
+        self.assertEqual(self.data["Major Version"], u"2")
+        self.assertEqual(image["Caption"], u"Caf\xe9 & bar")  # normalized to NFC
+        self.assertEqual(image["Comment"], u"None")
+        self.assertEqual(image["DateAsTimerInterval"], u"458591405.000000")
+        self.assertEqual((image["Hidden"], image["Flagged"]), (False, True))
+        self.assertEqual(image["Keywords"], [u"1", u"2"])
+        self.assertEqual(image["Thumbnail"], u"AAECAwQF")
+        self.assertEqual(self.data["Master Image List"]["2"]["Keywords"], [])
+        self.assertEqual(self.data["List of Rolls"], [{u"RollDate": u"2015-07-14T18:30:05Z"}])
+
+    def testSharedKeys(self):
+        first, second = [image.keys() for image in self.data["Master Image List"].values()]
+        self.assertIs([key for key in first if key == "Caption"][0], [key for key in second if key == "Caption"][0])
+
+    def testFile(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "AlbumData.xml")
+            with open(path, "wb") as f:
+                f.write(PLIST)
+
+            self.assertEqual(applexml.read_applexml(path), self.data)
+            self.assertEqual(applexml.read_applexml_sax(path), self.data)
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
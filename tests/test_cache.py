@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cache import DerivativeCache
+from photo import Derivative
+
+
+class EvictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def store(self, cache, checksums, size=100):
+        """
+        Store entries of two derivatives each, used in the order of the checksums
+        """
+        for i, checksum in enumerate(checksums):
+            cache.put(checksum, {"medium": Derivative(data="m" * size), "thumbnail": Derivative(data="t" * size)})
+            os.utime(cache._entryPath(checksum), (1000000000 + i, 1000000000 + i))
+
+    def testLeastRecentlyUsed(self):
+        cache = DerivativeCache(self.path, "settings", max_size=500)
+        self.store(cache, ["a", "b", "c", "d"])
+
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual([cache.get(checksum) is not None for checksum in "abcd"], [False, False, True, True])
+
+    def testGetMarksUsed(self):
+        cache = DerivativeCache(self.path, "settings", max_size=500)
+        self.store(cache, ["a", "b", "c", "d"])
+        cache.get("a")
+
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual([os.path.isdir(cache._entryPath(checksum)) for checksum in "abcd"],
+                         [True, False, False, True])
+
+    def testWithinLimit(self):
+        cache = DerivativeCache(self.path, "settings", max_size=800)
+        self.store(cache, ["a", "b", "c", "d"])
+
+        self.assertEqual(cache.evict(), 0)
+        self.assertTrue(all(os.path.isdir(cache._entryPath(checksum)) for checksum in "abcd"))
+
+    def testStrayFiles(self):
+        cache = DerivativeCache(self.path, "settings", max_size=500)
+        self.store(cache, ["a", "b", "c", "d"])
+
+        entry_path = cache._entryPath("a")
+        for path in (os.path.join(self.path, ".DS_Store"), os.path.join(os.path.dirname(entry_path), ".DS_Store")):
+            with open(path, "wb") as f:
+                f.write("x" * 1000)
+        os.makedirs(entry_path + ".1234.tmp")
+
+        self.assertEqual(cache.evict(), 2)
+        self.assertTrue(os.path.isdir(entry_path + ".1234.tmp"))
+
+    def testUnbounded(self):
+        cache = DerivativeCache(self.path, "settings")
+        self.store(cache, ["a", "b"])
+
+        self.assertEqual(cache.evict(), 0)
+        self.assertIsNotNone(cache.get("a"))
+
+    def testNoCacheDirectory(self):
+        self.assertEqual(DerivativeCache(self.path, "settings", max_size=0).evict(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
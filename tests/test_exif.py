@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import io
+import datetime
+import unittest
+
+import exif
+from fixtures import TiffBuilder, jpeg, app1, ASCII, SHORT, LONG, RATIONAL
+
+
+def exif_tiff(order, exif_ifd_offset=None):
+    """
+    Build the TIFF structure of an EXIF segment with IFD0 tags and an EXIF IFD
+    :param exif_ifd_offset: if set, the EXIF IFD pointer is replaced with this offset
+    """
+    builder = TiffBuilder(order)
+    exif_ifd = builder.addIfd([(0x829A, RATIONAL, [(1, 250)]), (0x8827, SHORT, [400]),
+                               (0x9205, RATIONAL, [(4, 1)]), (0x920A, RATIONAL, [(50, 1)]),
+                               (0x927C, ASCII, "MakerNote")])
+    builder.addIfd([(0x010F, ASCII, "Canon"), (0x0110, ASCII, "Canon EOS 5D"), (0x0112, SHORT, [6]),
+                    (0x0132, ASCII, "2015:07:14 18:30:05"),
+                    (exif.EXIF_IFD_POINTER, LONG, [exif_ifd if exif_ifd_offset is None else exif_ifd_offset])],
+                   first=True)
+    return builder.getvalue()
+
+
+class ReadExifTest(unittest.TestCase):
+
+    def assertExif(self, data):
+        self.assertEqual((data.make, data.model, data.orientation, data.datetime),
+                         ("Canon", "Canon EOS 5D", 6, "2015:07:14 18:30:05"))
+        self.assertEqual((data.shutter, data.iso, data.aperture, data.focal), ((1, 250), 400, (4, 1), (50, 1)))
+
+    def testJpeg(self):
+        for order in ("<", ">"):
+            self.assertExif(exif.read_exif("test.jpg", io.BytesIO(jpeg(640, 480, segments=app1(exif_tiff(order))))))
+
+    def testTiff(self):
+        for order in ("<", ">"):
+            self.assertExif(exif.read_exif("test.cr2", io.BytesIO(exif_tiff(order))))
+
+    def testSegmentsBeforeExif(self):
+        comment = "\xff\xfe\x00\x07hello"
+        data = jpeg(640, 480, segments=comment + app1(exif_tiff("<")))
+
+        self.assertExif(exif.read_exif("test.jpg", io.BytesIO(data)))
+
+    def testNoExif(self):
+        self.assertIsNone(exif.read_exif("test.jpg", io.BytesIO(jpeg(640, 480))))
+        self.assertIsNone(exif.read_exif("test.png", io.BytesIO("\x89PNG\r\n\x1a\n")))
+
+    def testXmpSegment(self):
+        xmp = "http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>"
+        data = jpeg(640, 480, segments="\xff\xe1" + chr(0) + chr(len(xmp) + 2) + xmp)
+
+        self.assertIsNone(exif.read_exif("test.jpg", io.BytesIO(data)))
+
+    def testExifIfdOutOfBounds(self):
+        data = exif.read_exif("test.jpg", io.BytesIO(jpeg(640, 480, segments=app1(exif_tiff("<", 4096)))))
+
+        self.assertEqual((data.make, data.datetime, data.iso), ("Canon", "2015:07:14 18:30:05", ""))
+
+    def testTruncatedSegment(self):
+        data = jpeg(640, 480, segments=app1(exif_tiff(">")))
+        end = data.index("Exif") + 30
+
+        self.assertIsNone(exif.read_exif("test.jpg", io.BytesIO(data[:end])))
+
+    def testTruncatedTiff(self):
+        self.assertIsNone(exif.read_exif("test.nef", io.BytesIO(exif_tiff("<")[:-10])))
+
+
+class ParseDatetimeTest(unittest.TestCase):
+
+    def testValid(self):
+        self.assertEqual(exif.parse_datetime("2015:07:14 18:30:05"), datetime.datetime(2015, 7, 14, 18, 30, 5))
+
+    def testInvalid(self):
+        for value in ("0000:00:00 00:00:00", "2015-07-14", "", None):
+            self.assertIsNone(exif.parse_datetime(value))
+
+
+if __name__ == "__main__":
+    unittest.main()
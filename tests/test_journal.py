@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import sqlite3
+import datetime
+import tempfile
+import unittest
+
+from exif import ExifData
+from journal import Journal
+
+TARGET = "lychee@example.com:/var/www/lychee"
+
+
+class FakePhoto(object):
+
+    def __init__(self, path, photo_id, album_id=1, size=1000, mtime=1436891405.0, date=""):
+        self.srcfullpath = path
+        self.id = photo_id
+        self.albumid = album_id
+        self.filesize = size
+        self.mtime = mtime
+        self.checksum = "checksum of " + path
+        self.exif = ExifData()
+        self.exif.datetime = date
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "journal", "journal.sqlite")
+        self.journal = Journal(self.path, TARGET)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.temp_dir)
+
+    def testRecord(self):
+        photo = FakePhoto("/photos/a.jpg", "1", date="2015:07:14 18:30:05")
+        self.assertIsNone(self.journal.uploadedDate(photo.srcfullpath, 1, photo.filesize, photo.mtime))
+
+        self.journal.record([photo])
+
+        self.assertEqual(self.journal.uploadedDate(photo.srcfullpath, 1, photo.filesize, photo.mtime),
+                         datetime.datetime(2015, 7, 14, 18, 30, 5))
+
+    def testModificationTimeDate(self):
+        photo = FakePhoto("/photos/a.jpg", "1", date="0000:00:00 00:00:00")
+        self.journal.record([photo])
+
+        self.assertEqual(self.journal.uploadedDate(photo.srcfullpath, 1, photo.filesize, photo.mtime),
+                         datetime.datetime.fromtimestamp(photo.mtime))
+
+    def testChangedFile(self):
+        photo = FakePhoto("/photos/a.jpg", "1")
+        self.journal.record([photo])
+
+        self.assertIsNone(self.journal.uploadedDate(photo.srcfullpath, 1, photo.filesize + 1, photo.mtime))
+        self.assertIsNone(self.journal.uploadedDate(photo.srcfullpath, 1, photo.filesize, photo.mtime + 1))
+        self.assertIsNone(self.journal.uploadedDate(photo.srcfullpath, 2, photo.filesize, photo.mtime))
+
+    def testStat(self):
+        path = os.path.join(self.temp_dir, "a.jpg")
+        with open(path, "wb") as f:
+            f.write("\xff\xd8\xff\xd9")
+        stat = os.stat(path)
+
+        self.journal.record([FakePhoto(path, "1", size=stat.st_size, mtime=stat.st_mtime)])
+
+        self.assertIsNotNone(self.journal.uploadedDate(path, 1))
+
+    def testMissingFile(self):
+        path = os.path.join(self.temp_dir, "missing.jpg")
+        self.journal.record([FakePhoto(path, "1")])
+
+        self.assertIsNone(self.journal.uploadedDate(path, 1))
+
+    def testTargets(self):
+        photo = FakePhoto("/photos/a.jpg", "1")
+        self.journal.record([photo])
+
+        other = Journal(self.path, "lychee@example.com:/srv/lychee")
+        try:
+            self.assertIsNone(other.uploadedDate(photo.srcfullpath, 1, photo.filesize, photo.mtime))
+        finally:
+            other.close()
+
+    def testInflight(self):
+        photos = [FakePhoto("/photos/a.jpg", "1"), FakePhoto("/photos/b.jpg", "2"), FakePhoto("/photos/c.jpg", "3")]
+        for photo in photos:
+            self.journal.begin(photo, ["/big/" + photo.id, "/thumb/" + photo.id])
+
+        self.journal.record(photos[:1])
+        self.assertEqual(self.journal.inflight(), {"2": ["/big/2", "/thumb/2"], "3": ["/big/3", "/thumb/3"]})
+
+        self.journal.commitInflight(["2"])
+        self.journal.forgetInflight(["3"])
+
+        self.assertEqual(self.journal.inflight(), {})
+        self.assertIsNotNone(self.journal.uploadedDate("/photos/b.jpg", 1, 1000, photos[1].mtime))
+        self.assertIsNone(self.journal.uploadedDate("/photos/c.jpg", 1, 1000, photos[2].mtime))
+
+    def testForgetPhotos(self):
+        photo = FakePhoto("/photos/a.jpg", "1")
+        self.journal.record([photo])
+        self.journal.forgetPhotos(["1"])
+
+        self.assertIsNone(self.journal.uploadedDate(photo.srcfullpath, 1, photo.filesize, photo.mtime))
+
+    def testOldJournal(self):
+        path = os.path.join(self.temp_dir, "old.sqlite")
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE files (target TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, "
+                   "mtime REAL NOT NULL, checksum TEXT NOT NULL, photo_id TEXT NOT NULL, album_id TEXT NOT NULL, "
+                   "PRIMARY KEY (target, path))")
+        db.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (TARGET, "/photos/a.jpg", 1000, 1436891405.0, "checksum", "1", "1"))
+        db.commit()
+        db.close()
+
+        journal = Journal(path, TARGET)
+        try:
+            self.assertEqual(journal.uploadedDate("/photos/a.jpg", 1, 1000, 1436891405.0),
+                             datetime.datetime.fromtimestamp(1436891405.0))
+        finally:
+            journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import unittest
+
+from pipeline import Pipeline
+
+# failures are logged, keep them out of the test output
+logging.getLogger("pipeline").addHandler(logging.NullHandler())
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+        self.lock = threading.Lock()
+
+    def collect(self, item):
+        with self.lock:
+            self.results.append(item)
+
+    def testStages(self):
+        pipeline = Pipeline(queue_size=2)
+        pipeline.addStage("double", lambda item: item * 2, workers=3)
+        pipeline.addStage("increment", lambda item: item + 1, workers=2)
+        pipeline.addStage("collect", self.collect)
+        pipeline.run(iter(range(100)))
+
+        self.assertEqual(sorted(self.results), [item * 2 + 1 for item in range(100)])
+
+    def testDroppedItems(self):
+        pipeline = Pipeline()
+        pipeline.addStage("filter", lambda item: item if item % 2 else None, workers=2)
+        pipeline.addStage("collect", self.collect)
+        pipeline.run(range(10))
+
+        self.assertEqual(sorted(self.results), [1, 3, 5, 7, 9])
+
+    def testFailedItems(self):
+        pipeline = Pipeline()
+        pipeline.addStage("invert", lambda item: 60 / item, workers=2)
+        pipeline.addStage("collect", self.collect)
+        pipeline.run([1, 0, 2, 0, 3])
+
+        self.assertEqual(sorted(self.results), [20, 30, 60])
+
+    def testFailedSource(self):
+        def source():
+            yield 1
+            yield 2
+            raise IOError("Cannot read the library")
+
+        pipeline = Pipeline()
+        pipeline.addStage("collect", self.collect, workers=2)
+        pipeline.run(source())
+
+        self.assertEqual(sorted(self.results), [1, 2])
+
+    def testBoundedQueues(self):
+        produced = []
+        release = threading.Event()
+
+        def source():
+            for item in range(20):
+                produced.append(item)
+                yield item
+
+        def wait(item):
+            release.wait()
+            return item
+
+        pipeline = Pipeline(queue_size=2)
+        pipeline.addStage("wait", wait)
+        pipeline.addStage("collect", self.collect)
+
+        thread = threading.Thread(target=pipeline.run, args=(source(),))
+        thread.start()
+        try:
+            thread.join(0.5)
+            # one item in the stage and a full queue, plus the item the source waits to put
+            self.assertLessEqual(len(produced), 4)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(sorted(self.results), range(20))
+
+
+if __name__ == "__main__":
+    unittest.main()
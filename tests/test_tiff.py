@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import io
+import unittest
+
+import tiff
+from fixtures import TiffBuilder, jpeg, ASCII, SHORT, LONG, RATIONAL, SRATIONAL
+
+
+def raw_file(order, previews, compression=None):
+    """
+    Build a RAW-like TIFF file with JPEG previews: the first one in IFD0, the others in sub-IFDs
+    :param previews: a list of JPEG streams
+    :param compression: if set, previews are stored as single strips with this compression instead of with the JPEG
+                        offset and length tags
+    """
+    builder = TiffBuilder(order)
+    sub_ifds = []
+
+    for i, data in enumerate(previews):
+        offset = builder.append(data)
+        if compression is None:
+            entries = [(tiff.TiffReader.TAG_JPEG_OFFSET, LONG, [offset]),
+                       (tiff.TiffReader.TAG_JPEG_LENGTH, LONG, [len(data)])]
+        else:
+            entries = [(tiff.TiffReader.TAG_COMPRESSION, SHORT, [compression]),
+                       (tiff.TiffReader.TAG_STRIP_OFFSETS, LONG, [offset]),
+                       (tiff.TiffReader.TAG_STRIP_BYTE_COUNTS, LONG, [len(data)])]
+
+        if i == 0:
+            ifd0_entries = entries
+        else:
+            sub_ifds.append(builder.addIfd(entries))
+
+    if sub_ifds:
+        ifd0_entries.append((tiff.TiffReader.TAG_SUB_IFDS, LONG, sub_ifds))
+    builder.addIfd(ifd0_entries, first=True)
+
+    return builder.getvalue()
+
+
+class TiffReaderTest(unittest.TestCase):
+
+    def testByteOrder(self):
+        for order in ("<", ">"):
+            builder = TiffBuilder(order)
+            builder.addIfd([(0x010F, ASCII, "Canon"), (0x0112, SHORT, [6]), (0x829A, RATIONAL, [(1, 250)]),
+                            (0x9204, SRATIONAL, [(-1, 3)]), (0x0111, LONG, [1, 2, 3])], first=True)
+
+            reader = tiff.TiffReader(io.BytesIO(builder.getvalue()))
+            tags, next_ifd = reader.readIfd(reader.first_ifd)
+
+            self.assertEqual(tags, {0x010F: "Canon", 0x0112: [6], 0x829A: [(1, 250)], 0x9204: [(-1, 3)],
+                                    0x0111: [1, 2, 3]})
+            self.assertEqual(next_ifd, 0)
+
+    def testWantedTags(self):
+        builder = TiffBuilder()
+        builder.addIfd([(0x010F, ASCII, "Canon"), (0x0112, SHORT, [6])], first=True)
+
+        reader = tiff.TiffReader(io.BytesIO(builder.getvalue()))
+        self.assertEqual(reader.readIfd(reader.first_ifd, [0x0112])[0], {0x0112: [6]})
+
+    def testNotTiff(self):
+        self.assertRaises(tiff.TiffError, tiff.TiffReader, io.BytesIO("\xff\xd8\xff\xe0\x00\x10JFIF"))
+
+    def testTruncatedHeader(self):
+        self.assertRaises(tiff.TiffError, tiff.TiffReader, io.BytesIO("II*\x00"))
+
+    def testIfdOutOfBounds(self):
+        builder = TiffBuilder()
+        builder.setFirstIfd(4096)
+
+        reader = tiff.TiffReader(io.BytesIO(builder.getvalue()))
+        self.assertRaises(tiff.TiffError, reader.readIfd, reader.first_ifd)
+
+    def testTruncatedIfd(self):
+        builder = TiffBuilder()
+        builder.addIfd([(0x010F, ASCII, "Canon"), (0x0112, SHORT, [6])], first=True)
+        data = builder.getvalue()
+
+        reader = tiff.TiffReader(io.BytesIO(data[:-6]))
+        self.assertRaises(tiff.TiffError, reader.readIfd, reader.first_ifd)
+
+    def testValueOutOfBounds(self):
+        builder = TiffBuilder()
+        offset = builder.addIfd([(0x010F, ASCII, "Canon EOS")], first=True)
+        builder.patchLong(offset + 2 + 8, 4096)
+
+        reader = tiff.TiffReader(io.BytesIO(builder.getvalue()))
+        self.assertRaises(tiff.TiffError, reader.readIfd, reader.first_ifd)
+
+    def testIfdLoop(self):
+        builder = TiffBuilder()
+        offset = builder.addIfd([(0x0112, SHORT, [1])], first=True)
+        builder.patchLong(offset + 2 + 12, offset)
+
+        reader = tiff.TiffReader(io.BytesIO(builder.getvalue()))
+        self.assertEqual(reader.ifds(), [{0x0112: [1]}])
+
+
+class EmbeddedJpegTest(unittest.TestCase):
+
+    def testBiggestPreview(self):
+        for order in ("<", ">"):
+            small, big = jpeg(160, 120), jpeg(3000, 2000)
+            data = raw_file(order, [small, big])
+
+            reader = tiff.TiffReader(io.BytesIO(data))
+            self.assertEqual(sorted(size[:2] for size in reader.embeddedJpegs()), [(160, 120), (3000, 2000)])
+            self.assertEqual(tiff.embedded_jpeg("test.cr2", io.BytesIO(data)), big)
+
+    def testStripPreview(self):
+        preview = jpeg(1616, 1080, sof=0xc2)
+        data = raw_file("<", [preview], compression=6)
+
+        self.assertEqual(tiff.embedded_jpeg("test.cr2", io.BytesIO(data)), preview)
+
+    def testLosslessJpegRejected(self):
+        preview, sensor_data = jpeg(1616, 1080), jpeg(5184, 3456, sof=0xc3)
+        data = raw_file(">", [preview, sensor_data], compression=7)
+
+        reader = tiff.TiffReader(io.BytesIO(data))
+        self.assertEqual([size[:2] for size in reader.embeddedJpegs()], [(1616, 1080)])
+        self.assertEqual(tiff.embedded_jpeg("test.dng", io.BytesIO(data)), preview)
+
+    def testPreviewOutOfBounds(self):
+        builder = TiffBuilder()
+        builder.addIfd([(tiff.TiffReader.TAG_JPEG_OFFSET, LONG, [4096]),
+                        (tiff.TiffReader.TAG_JPEG_LENGTH, LONG, [100])], first=True)
+
+        self.assertEqual(tiff.TiffReader(io.BytesIO(builder.getvalue())).embeddedJpegs(), [])
+        self.assertIsNone(tiff.embedded_jpeg("test.nef", io.BytesIO(builder.getvalue())))
+
+    def testTruncatedPreview(self):
+        builder = TiffBuilder()
+        offset = builder.append(jpeg(3000, 2000))
+        builder.addIfd([(tiff.TiffReader.TAG_JPEG_OFFSET, LONG, [offset]),
+                        (tiff.TiffReader.TAG_JPEG_LENGTH, LONG, [65536])], first=True)
+
+        self.assertIsNone(tiff.embedded_jpeg("test.cr2", io.BytesIO(builder.getvalue())))
+
+    def testNoPreview(self):
+        self.assertIsNone(tiff.embedded_jpeg("test.cr2", io.BytesIO("not a TIFF file")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import logging
+
+from conf import conf
+
+logger = logging.getLogger(__name__)
+
+
+class TiffError(Exception):
+    pass
+
+
+class TiffReader:
+    """
+    Minimal reader of the TIFF structure, which RAW formats like CR2, NEF, ARW and DNG are built on. Only the image
+    file directories (IFDs) are read, image data is never decoded.
+    """
+
+    # sizes of TIFF field types in bytes
+    TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+    # struct formats of integer and rational field types
+    TYPE_FORMATS = {1: "B", 3: "H", 4: "I", 5: "II", 6: "b", 8: "h", 9: "i", 10: "ii", 13: "I"}
+    TYPE_ASCII = 2
+    TYPES_RATIONAL = (5, 10)
+
+    MAX_IFDS = 64
+
+    TAG_SUB_IFDS = 0x014A
+    TAG_COMPRESSION = 0x0103
+    TAG_STRIP_OFFSETS = 0x0111
+    TAG_STRIP_BYTE_COUNTS = 0x0117
+    TAG_JPEG_OFFSET = 0x0201
+    TAG_JPEG_LENGTH = 0x0202
+
+
+    def __init__(self, f):
+        """
+        :param f: a file object opened in binary mode
+        """
+        self.f = f
+
+        header = self._read(0, 8)
+        if header[:2] == "II":
+            self.order = "<"
+        elif header[:2] == "MM":
+            self.order = ">"
+        else:
+            raise TiffError("Not a TIFF file")
+
+        self.first_ifd = struct.unpack(self.order + "I", header[4:8])[0]
+
+
+    def _read(self, offset, length):
+        self.f.seek(offset)
+        data = self.f.read(length)
+        if len(data) < length:
+            raise TiffError("Unexpected end of file")
+        return data
+
+
+    def readIfd(self, offset, wanted=None):
+        """
+        Read an IFD
+        :param offset: offset of the IFD in the file
+        :param wanted: a collection of tags to read. All tags are read by default
+        :return: a tuple of a dictionary of tags and their values and the offset of the next IFD. Integer values are
+                 lists of integers, rational values lists of (numerator, denominator) tuples and ASCII values strings.
+                 Tags of other types are left out
+        """
+        count = struct.unpack(self.order + "H", self._read(offset, 2))[0]
+        entries = self._read(offset + 2, count * 12 + 4)
+        tags = {}
+
+        for i in range(count):
+            tag, field_type, value_count = struct.unpack(self.order + "HHI", entries[i * 12:i * 12 + 8])
+
+            if wanted is not None and tag not in wanted:
+                continue
+            if field_type not in self.TYPE_FORMATS and field_type != self.TYPE_ASCII or value_count > 4096:
+                continue
+
+            size = self.TYPE_SIZES[field_type] * value_count
+            if size <= 4:
+                data = entries[i * 12 + 8:i * 12 + 8 + size]
+            else:
+                data = self._read(struct.unpack(self.order + "I", entries[i * 12 + 8:i * 12 + 12])[0], size)
+
+            if field_type == self.TYPE_ASCII:
+                tags[tag] = data.split("\x00", 1)[0]
+                continue
+
+            values = struct.unpack(self.order + self.TYPE_FORMATS[field_type] * value_count, data)
+            if field_type in self.TYPES_RATIONAL:
+                values = zip(values[::2], values[1::2])
+
+            tags[tag] = list(values)
+
+        next_ifd = struct.unpack(self.order + "I", entries[count * 12:count * 12 + 4])[0]
+        return tags, next_ifd
+
+
+    def ifds(self):
+        """
+        Read all the IFDs of the file: the main chain and the sub-IFDs, where RAW formats keep full size previews and
+        raw data
+        :return: a list of dictionaries of tags and their values
+        """
+        result = []
+        pending = [self.first_ifd]
+        seen = set()
+
+        while pending and len(result) < self.MAX_IFDS:
+            offset = pending.pop(0)
+            if not offset or offset in seen:
+                continue
+            seen.add(offset)
+
+            tags, next_ifd = self.readIfd(offset)
+            result.append(tags)
+            pending.append(next_ifd)
+            pending.extend(tags.get(self.TAG_SUB_IFDS, []))
+
+        return result
+
+
+    def jpegSize(self, offset):
+        """
+        Read the size of a JPEG stream from its frame header
+        :param offset: offset of the JPEG stream in the file
+        :return: a tuple of width and height, or None if the stream is not a baseline or progressive JPEG, e.g. a
+                 lossless JPEG with raw sensor data
+        """
+        if self._read(offset, 2) != "\xff\xd8":
+            return None
+
+        position = offset + 2
+        for i in range(64):
+            marker, length = struct.unpack(">BBH", self._read(position, 4))[1:]
+
+            if marker in (0xc0, 0xc1, 0xc2):
+                height, width = struct.unpack(">HH", self._read(position + 5, 4))
+                return width, height
+            elif 0xc3 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc) or marker == 0xda:
+                return None  # lossless, hierarchical or arithmetic coding, or no frame header at all
+
+            position += 2 + length
+
+        return None
+
+
+    def embeddedJpegs(self):
+        """
+        Find JPEG images embedded in the file
+        :return: a list of (width, height, offset, length) tuples
+        """
+        candidates = set()
+
+        for tags in self.ifds():
+            if self.TAG_JPEG_OFFSET in tags and self.TAG_JPEG_LENGTH in tags:
+                candidates.add((tags[self.TAG_JPEG_OFFSET][0], tags[self.TAG_JPEG_LENGTH][0]))
+
+            # old-style JPEG compression (CR2) or JPEG compression (DNG) in a single strip
+            if tags.get(self.TAG_COMPRESSION, [None])[0] in (6, 7) and \
+                    len(tags.get(self.TAG_STRIP_OFFSETS, [])) == 1 and len(tags.get(self.TAG_STRIP_BYTE_COUNTS, [])) == 1:
+                candidates.add((tags[self.TAG_STRIP_OFFSETS][0], tags[self.TAG_STRIP_BYTE_COUNTS][0]))
+
+        jpegs = []
+        for offset, length in candidates:
+            try:
+                size = self.jpegSize(offset)
+            except (TiffError, struct.error):
+                continue
+
+            if size:
+                jpegs.append((size[0], size[1], offset, length))
+
+        return jpegs
+
+
+def embedded_jpeg(path, f=None):
+    """
+    Extract the biggest JPEG preview embedded in a TIFF based RAW file
+    :param path: path to the RAW file
+    :param f: a file object of the RAW file opened in binary mode, if the file is open already
+    :return: the JPEG data or None if there is no preview
+    """
+    logger.setLevel(conf.verbose)
+
+    try:
+        if f is None:
+            with open(path, "rb") as f:
+                return _extract_jpeg(path, f)
+
+        return _extract_jpeg(path, f)
+    except (TiffError, struct.error):
+        logger.warning("Cannot read TIFF structure of {}".format(path), exc_info=True)
+        return None
+
+
+def _extract_jpeg(path, f):
+    reader = TiffReader(f)
+    jpegs = reader.embeddedJpegs()
+
+    if not jpegs:
+        return None
+
+    width, height, offset, length = max(jpegs)
+    logger.debug("Using {}x{} embedded preview of {}".format(width, height, path))
+    return reader._read(offset, length)
@@ -2,15 +2,39 @@
 
 import os
 import logging
+import datetime
+import multiprocessing
+import threading
 import ssh
 
 from database import Database
-from photo import LycheePhoto
+from photo import LycheePhoto, UnchangedPhoto, file_size, photo_title
+from cache import DerivativeCache
+from exif import parse_datetime
+from pipeline import Pipeline
+from journal import Journal
 from conf import conf
 
 logger = logging.getLogger(__name__)
 
 
+def _build_photo(args):
+    """
+    Create a LycheePhoto object in a worker process. Defined on the module level, so that it can be pickled.
+    :param args: a tuple of the full path to the photo, the album id, a set of checksums of the photos with the
+                 same name in the album and paths to previews of the photo. If the checksum of the photo is among the
+                 checksums, then the photo is unchanged and is not processed any further. The checksum is computed
+                 from the same read of the photo it is processed from
+    :return: a LycheePhoto object or None if the photo is unchanged
+    """
+    full_path, album_id, checksums, previews = args
+
+    try:
+        return LycheePhoto(full_path, album_id, previews=previews, replaced_checksums=checksums)
+    except UnchangedPhoto:
+        return None
+
+
 class Upload:
     """
     High-level logic for uploading images to the remote server. The class is responsible for initiating SSH and
@@ -27,6 +51,11 @@ class Upload:
         else:
             raise Exception("Lychee configuration file not found. Please check the path to Lychee installation")
 
+        if conf.journal:
+            self.journal = Journal(conf.journal, "{}@{}:{}".format(conf.username, conf.server, conf.path))
+        else:
+            self.journal = None
+
 
 
     def createAlbum(self, album_name):
@@ -42,13 +71,172 @@ class Upload:
         return album_id
 
 
-    def uploadPhoto(self, photo):
+    def prepareAlbum(self, album_name):
         """
-        Upload a photo to the remote server and add it to the album it belongs to in the database. If database update
-        fails for some reason, photos are deleted from the server.
+        Find the album photos are uploaded to. The album is created if it does not exist yet. If it is to be
+        replaced, then its photos are loaded for synchronisation
+        :param album_name: name of the album
+        :return: album id
+        """
+        if album_name == "{unsorted}":
+            album_id = 0
+        else:
+            album_id = self.dao.albumExists(album_name)
+
+        if album_id is None: # create album
+            album_id = self.createAlbum(album_name)
+            self.created += 1
+        elif conf.replace and album_id not in self.sync: # synchronise album photos
+            self.sync[album_id] = (self.dao.getAlbumPhotos(album_id), set())
+
+        return album_id
+
+
+    def photoExists(self, album_id, record):
+        """
+        Check if a photo already exists in the album. Only the file name and optionally the file size are checked, so
+        that photos are never decoded or hashed unless they are going to be uploaded.
+        :param album_id: id of the album
+        :param record: a PhotoRecord of the photo
+        :return: True if the photo exists
+        """
+        album_name = record.album
+        file_name = os.path.basename(record.path)
+        size = file_size(record.path, record.size) if conf.check_size else None
+
+        with self.db_lock:
+            exists = self.dao.photoExists(album_id, file_name, size)
+
+        if exists:
+            logger.info("Photo {}/{} already exists".format(album_name, file_name))
+
+        return exists
+
+
+    def scanPhotos(self, albums):
+        """
+        Enumerate photos to upload. This is the first stage of the upload pipeline. Albums are prepared as they are
+        reached and photos that already exist in Lychee are skipped. Skipped photos count towards album dates with
+        the date recorded in the journal or their modification time, they are never opened. In albums that are synchronised, photos with the same name as a photo in Lychee are
+        passed along with the Lychee photos they may replace, and Lychee photos without a local counterpart are deleted
+        once all the photos are enumerated.
+        :param albums: an iterable of PhotoRecord tuples. It is consumed lazily
+        :return: a generator of (PhotoRecord, album id, list of replaced photos) tuples
+        """
+        album_ids = {}
+
+        for record in albums:
+            if record.album not in album_ids:
+                with self.db_lock:
+                    album_ids[record.album] = self.prepareAlbum(record.album)
+
+            album_id = album_ids[record.album]
+            full_path = record.path
+            file_name = os.path.basename(full_path)
+            self.discovered += 1
+
+            if album_id in self.sync:
+                remote, seen = self.sync[album_id]
+                seen.add(photo_title(file_name))
+
+            uploaded_date = None
+            if self.journal:
+                uploaded_date = self.journal.uploadedDate(full_path, album_id, record.size, record.mtime)
+
+            if uploaded_date is not None:
+                logger.debug("Photo {} has not changed since the last upload".format(full_path))
+                self.updateAlbumDate(album_id, record.date or uploaded_date)
+            elif album_id in self.sync:
+                yield record, album_id, remote.get(photo_title(file_name), [])
+            elif not self.photoExists(album_id, record):
+                yield record, album_id, []
+            else:
+                self.updateAlbumDate(album_id, self.photoDate(record))
+
+        # an album may occur more than once, so synchronisation of albums is finished only when all the photos are
+        # enumerated. Removed photos are deleted right away, together with the photos queued so far
+        with self.db_lock:
+            for album_id, (remote, seen) in self.sync.items():
+                self.dao.deletePhotos([photo for title in remote if title not in seen for photo in remote[title]])
+
+            if self.sync:
+                self.flushPhotos()
+
+
+    def photoDate(self, record, exif_date=None):
+        """
+        Get the date a photo was taken
+        :param record: a PhotoRecord of the photo
+        :param exif_date: the EXIF date of the photo, if the photo has been processed
+        :return: the date provided by the photo source, the EXIF date or the modification time of the photo file. None
+                 if the file cannot be accessed
+        """
+        if record.date is not None:
+            return record.date
+
+        if exif_date is not None:
+            return exif_date
+
+        try:
+            mtime = record.mtime if record.mtime is not None else os.path.getmtime(record.path)
+        except OSError:
+            return None
+
+        return datetime.datetime.fromtimestamp(mtime)
+
+
+    def updateAlbumDate(self, album_id, date):
+        """
+        Keep the date of the newest photo of an album. The dates are written into the database at the end of the upload
+        :param album_id: id of the album
+        :param date: date of a photo in the album
+        """
+        if not album_id or date is None:
+            return
+
+        with self.dates_lock:
+            if self.album_dates.get(album_id, date) <= date:
+                self.album_dates[album_id] = date
+
+
+    def processPhoto(self, item):
+        """
+        Convert a photo path into a LycheePhoto object, generating derivatives, EXIF data and the checksum. If a
+        process pool is used, then the work is done by a worker process. Photos identical to the Lychee photos they
+        would replace are dropped. The album date is updated with the EXIF date of the photo
+        :param item: a tuple of the PhotoRecord of the photo, the album id and a list of replaced photos
+        :return: a LycheePhoto object or None if the photo is unchanged
+        """
+        record, album_id, replaced = item
+        full_path = record.path
+        args = (full_path, album_id, set(checksum for photo_id, checksum, url in replaced), record.previews)
+
+        if self.pool:
+            photo = self.pool.apply(_build_photo, (args,))
+        else:
+            photo = _build_photo(args)
+
+        if photo is None:
+            logger.info("Photo {} has not changed".format(full_path))
+            self.updateAlbumDate(album_id, self.photoDate(record))
+            return None
+
+        self.updateAlbumDate(album_id, self.photoDate(record, parse_datetime(photo.exif.datetime)))
+
+        if self.pool:
+            photo.generateId()
+
+        if replaced:
+            self.replaced[photo.id] = replaced
 
+        return photo
+
+
+    def transferPhoto(self, photo):
+        """
+        Upload a photo to the remote server. Local derivatives are deleted afterwards
         :param photo: a valid LycheePhoto object
-        :return: True if everything went ok
+        :return: the photo if everything went ok, None otherwise
         """
         album_name = os.path.dirname(photo.srcfullpath).split(os.sep)[-1]
         file_name = os.path.basename(photo.srcfullpath)
@@ -56,105 +244,219 @@ class Upload:
         try:
             thumbnail_path = os.path.join(conf.path, "uploads", "thumb")
             medium_path = os.path.join(conf.path, "uploads", "medium", photo.url)
-            import_path = os.path.join(conf.path, "uploads", "import", photo.url)
+            import_path = os.path.join(conf.path, "uploads", "import", photo.originalUrl)
 
-            # if the big flag is set, upload the resized photo to the big directory and the original photo into the
-            # import directory
-            if "big_size" in dir(conf):
-                self.ssh.put(photo.big_path, photo.destfullpath)
+            # the big directory receives either the resized photo if the big flag is set, or the original one. If the
+            # originals flag is set as well, the original photo goes into the import directory. Browsers cannot display
+            # RAW photos, so their big picture is always a JPEG image and the RAW file always goes into the import
+            # directory, so that the original is kept on the server
+            files = [(photo.big.source(), photo.destfullpath),
+                     (photo.medium.source(), medium_path),
+                     (photo.thumbnail.source(), os.path.join(thumbnail_path, photo.url)),
+                     (photo.thumbnailx2.source(), os.path.join(thumbnail_path, photo.thumb2xUrl))]
 
-            if "upload_originals" in dir(conf):
-                self.ssh.put(photo.srcfullpath, import_path)
+            if self.uploadsOriginal(photo):
+                files.append((photo.srcfullpath, import_path))
 
-            self.ssh.put(photo.medium_path, medium_path)
-            self.ssh.put(photo.thumbnailfullpath, os.path.join(thumbnail_path, photo.url))
-            self.ssh.put(photo.thumbnailx2fullpath, os.path.join(thumbnail_path, photo.thumb2xUrl))
+            if self.journal:
+                self.journal.begin(photo, [destination for source, destination in files])
 
-            if self.dao.addFileToAlbum(photo):
-                logger.info("Uploaded file {}/{}".format(album_name, file_name))
-                return True
-            else:
-                self.ssh.remove(photo.destfullpath)
-                self.ssh.remove(os.path.join(medium_path, photo.url))
-                self.ssh.remove(os.path.join(thumbnail_path, photo.url))
-                self.ssh.remove(os.path.join(thumbnail_path, photo.thumb2xUrl))
+            if not self.ssh.putAll(files):
+                self.removePhotoFiles(photo)
+                self.keepReplaced(photo)
+                return None
 
-                return False
+            logger.info("Uploaded file {}/{}".format(album_name, file_name))
+
+            return photo
+        except Exception:
+            logger.error("Uploading photo {}/{} failed".format(album_name, file_name))
+            self.keepReplaced(photo)
 
+            return None
+        finally:
             # delete thumbnails
             photo.cleanup()
 
-            return True
-        except Exception:
-            logger.error("Uploading photo {}/{} failed".format(album_name, file_name))
 
-            return False
+    def keepReplaced(self, photo):
+        """
+        Keep the Lychee photos a photo would replace, once the photo fails to upload. The old photo stays in the album
+        instead of leaving the album without either of them. The next run tries to replace it again
+        :param photo: a LycheePhoto object
+        """
+        if self.replaced.pop(photo.id, None):
+            logger.warning("Keeping the previous version of {}".format(photo.srcfullpath))
+
+
+    def commitPhoto(self, photo):
+        """
+        Add an uploaded photo to the album it belongs to in the database. Photos are queued and inserted in batches of
+        conf.batch_size photos. If database update fails for some reason, photos are deleted from the server.
+        :param photo: a valid LycheePhoto object
+        """
+        with self.db_lock:
+            # replaced photos are deleted in the same transaction the new photo is inserted in
+            self.dao.deletePhotos(self.replaced.pop(photo.id, []))
+
+            if self.dao.addFileToAlbum(photo) >= conf.batch_size:
+                self.flushPhotos()
+
+
+    def flushPhotos(self):
+        """
+        Insert the queued photos into the database. Files of the photos that could not be inserted are deleted from
+        the server.
+        :return: number of photos inserted into the database
+        """
+        photos = self.dao.pending[:]
+        count = len(photos)
+        failed, deleted = self.dao.flush()
+
+        for photo in failed:
+            self.removePhotoFiles(photo)
+
+        if deleted:
+            self.deleteFiles([url for photo_id, checksum, url in deleted])
+            self.removed += len(deleted)
+
+        if self.journal:
+            self.journal.record([photo for photo in photos if photo not in failed])
+            self.journal.forgetPhotos([photo_id for photo_id, checksum, url in deleted])
+
+        self.imported += count - len(failed)
+        return count - len(failed)
+
+
+    def uploadsOriginal(self, photo):
+        """
+        :param photo: a LycheePhoto object
+        :return: True if the source photo is uploaded into the import directory
+        """
+        return "upload_originals" in dir(conf) or photo.isRaw()
+
+
+    def removePhotoFiles(self, photo):
+        """
+        Delete files of an uploaded photo from the server
+        :param photo: a LycheePhoto object
+        """
+        thumbnail_path = os.path.join(conf.path, "uploads", "thumb")
+
+        self.ssh.removeAll([photo.destfullpath,
+                            os.path.join(conf.path, "uploads", "medium", photo.url),
+                            os.path.join(thumbnail_path, photo.url),
+                            os.path.join(thumbnail_path, photo.thumb2xUrl)])
+
+        # the upload may have failed before the original was transferred
+        if self.uploadsOriginal(photo):
+            self.ssh.removeAll([os.path.join(conf.path, "uploads", "import", photo.originalUrl)], missing_ok=True)
+
+        if self.journal:
+            self.journal.forgetInflight([photo.id])
+
+
+    def recover(self):
+        """
+        Clean up after an interrupted run. Photos, which were in flight when the previous run stopped, are recorded
+        in the journal as uploaded if they made it into the database. Files of the others are deleted from the server
+        in one batch, so the photos are uploaded again from scratch.
+        """
+        inflight = self.journal.inflight()
+        if not inflight:
+            return
+
+        committed = self.dao.photoIdsExist(inflight.keys())
+        self.journal.commitInflight(committed)
+
+        orphans = [photo_id for photo_id in inflight if photo_id not in committed]
+        self.ssh.removeAll([path for photo_id in orphans for path in inflight[photo_id]])
+        self.journal.forgetInflight(orphans)
+
+        print "Resumed an interrupted upload: {} photos completed, {} incomplete photos removed".format(
+            len(committed), len(orphans))
 
 
     def deleteFiles(self, filelist):
         """
-        Delete files in the Lychee file tree (uploads/big and uploads/thumbnails)
-        :param filelist: a list of filenames to delte
+        Delete files in the Lychee file tree (uploads/big, uploads/medium and uploads/thumb) and originals in
+        uploads/import. The database does not record whether a photo has an original and which extension a RAW original
+        has, so every possible original is deleted if it exists
+        :param filelist: a list of photo urls to delete
         """
+        paths = []
+        originals = []
 
         for url in filelist:
-            if self.isAPhoto(url):
-                thumbpath = os.path.join(conf.path, "uploads", "thumb", url)
-                filesplit = os.path.splitext(url)
-                thumb2path = ''.join([filesplit[0], "@2x", filesplit[1]]).lower()
-                thumb2path = os.path.join(conf.path, "uploads", "thumb", thumb2path)
-                bigpath = os.path.join(conf.path, "uploads", "big", url)
+            filesplit = os.path.splitext(url)
+            thumb2url = ''.join([filesplit[0], "@2x", filesplit[1]]).lower()
 
-                self.ssh.remove(thumbpath)
-                self.ssh.remove(thumb2path)
-                self.ssh.remove(bigpath)
+            paths.append(os.path.join(conf.path, "uploads", "big", url))
+            paths.append(os.path.join(conf.path, "uploads", "medium", url))
+            paths.append(os.path.join(conf.path, "uploads", "thumb", url))
+            paths.append(os.path.join(conf.path, "uploads", "thumb", thumb2url))
+
+            originals.append(os.path.join(conf.path, "uploads", "import", url))
+            if filesplit[1] == ".jpg":
+                originals.extend(os.path.join(conf.path, "uploads", "import", filesplit[0] + ext)
+                                 for ext in LycheePhoto.RAW_EXTENSIONS)
+
+        self.ssh.removeAll(paths)
+        self.ssh.removeAll(originals, missing_ok=True)
 
 
     def upload(self, albums):
         """
-        Upload photos stored in the provided dictionary, create albums. Accept a dictionary of album names and image
-        paths as input parameter and convert each image path into a LycheePhoto object, which is passed to the
-        uploadPhoto funciton.
-        :param albums: a dictionary with albums and path names
+        Upload photos produced by a photo source, create albums. Photos flow through a pipeline of four stages
+        connected with bounded queues: enumeration of photos to upload, generation of derivatives (conf.jobs workers),
+        transfer to the server (conf.connections workers) and insertion into the database, so that processing, disk and
+        network work overlap. The source is consumed as the pipeline goes, so uploading starts as soon as the first
+        photo is found and photos are never all held in memory.
+        :param albums: an iterable of PhotoRecord tuples, e.g. a generator returned by a source's get_photos()
         """
         print("Uploading photos...")
 
-        createdalbums, discoveredphotos, importedphotos = 0, 0, 0
+        self.created, self.discovered, self.imported, self.removed = 0, 0, 0, 0
+        self.album_dates = {}
+        self.sync = {}
+        self.replaced = {}
+        self.db_lock = threading.Lock()
+        self.dates_lock = threading.Lock()
 
-        for album_name, files in albums.items():
-            album_date = None
-            if album_name == "{unsorted}":
-                album_id = 0
-            else:
-                album_id = self.dao.albumExists(album_name)
+        if self.journal:
+            self.recover()
 
-            if album_id is None: # create album
-                album_id = self.createAlbum(album_name)
-                createdalbums += 1
-            elif conf.replace: # drop album photos
-                filelist = self.dao.eraseAlbum(album_id)
-                self.deleteFiles(filelist)
+        if conf.jobs > 1:
+            self.pool = multiprocessing.Pool(conf.jobs)
+        else:
+            self.pool = None
+
+        pipeline = Pipeline()
+        pipeline.addStage("process", self.processPhoto, conf.jobs)
+        pipeline.addStage("transfer", self.transferPhoto, conf.connections)
+        pipeline.addStage("commit", self.commitPhoto)
+        pipeline.run(self.scanPhotos(albums))
 
-            for full_path in files:
-                discoveredphotos += 1
-                photo = LycheePhoto(full_path, album_id)
+        self.flushPhotos()
 
-                if album_date is None or album_date < photo.datetime:
-                    album_date = photo.datetime
+        if self.album_dates:  # set correct album dates
+            self.dao.updateAlbumDates(self.album_dates)
 
-                if not self.dao.photoExists(photo):
-                    if self.uploadPhoto(photo):
-                        importedphotos += 1
-                else:
-                    file_name = os.path.basename(photo.srcfullpath)
-                    logger.info("Photo {}/{} already exists".format(album_name, file_name))
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
 
-                if album_id:  # set correct album date
-                    self.dao.updateAlbumDate(album_id, album_date)
+        if conf.cache_dir:
+            DerivativeCache(conf.cache_dir, LycheePhoto.derivativeSettings(), conf.cache_size).evict()
 
         self.dao.close()
 
+        if self.journal:
+            self.journal.close()
+
         # Final report
-        print "{} out of {} photos imported".format(importedphotos, discoveredphotos)
+        print "{} out of {} photos imported".format(self.imported, self.discovered)
+        if self.removed:
+            print "{} photos removed".format(self.removed)
 
 